@@ -4,14 +4,28 @@
 
 import fnmatch
 import glob
+import hashlib
+import json
 import os
 import shutil
 import tarfile
+import time
 import zipfile
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from threading import RLock
 
-from . import log, paths, update
+from . import filesync, log, paths, update
 from .lnp import lnp
 
+# Prepared baselines, as {'folder': ..., 'mtime': ..., 'versions': {...}}
+_registry = {}
+_registry_lock = RLock()
+
+# Vanilla file digests used to spot unchanged raws in packs
+_vanilla_hashes = {}
+_vanilla_manifests = {}
+
 
 def find_vanilla(download_missing=True):
     """Finds the vanilla baseline for the current version.
@@ -27,10 +41,10 @@ def find_vanilla(download_missing=True):
     if lnp.df_info.source == "init detection":
         log.w('Baseline DF version from init detection; highly unreliable!')
         return None
-    prepare_baselines()
     version = 'df_' + str(lnp.df_info.version)[2:].replace('.', '_')
-    if os.path.isdir(paths.get('baselines', version)):
-        return paths.get('baselines', version)
+    versions = get_versions()
+    if version in versions:
+        return versions[version]
     if download_missing:
         update.download_df_baseline()
     return False
@@ -44,6 +58,118 @@ def find_vanilla_raws(download_missing=True):
     return retval
 
 
+def get_versions():
+    """Returns a dict of {version: path} for the prepared baselines, eg
+    ``{'df_40_15': 'LNP/Baselines/df_40_15'}``.
+
+    The baselines folder is only scanned (and new archives extracted) when its
+    modification time changes, or after `invalidate` is called.
+    """
+    folder = paths.get('baselines')
+    with _registry_lock:
+        mtime = paths.mtime(folder)
+        if (_registry.get('folder') != folder
+                or _registry.get('mtime') != mtime):
+            prepare_baselines()
+            versions = {}
+            if paths.mtime(folder) is not None:
+                for d in os.listdir(folder):
+                    path = os.path.join(folder, d)
+                    if (d.startswith('df_') and '.' not in d
+                            and os.path.isdir(path)):
+                        versions[d] = path
+                _update_store(versions)
+            _registry.update(folder=folder, mtime=paths.mtime(folder),
+                             versions=versions)
+        return _registry['versions']
+
+
+def get_manifest(version):
+    """Returns the manifest of a baseline, as a dict of {relative path:
+    hash}, adding the baseline to the store first if needed.
+
+    Baseline files are kept in a content-addressed store in
+    LNP/Baselines/store; version folders hard link to the stored blobs, so
+    files shared between versions only use disk space once.
+    """
+    # Held while storing, so a version is never stored twice at once
+    with _registry_lock:
+        try:
+            with open(_store_path(version + '.json'), encoding='utf-8') as f:
+                return json.load(f)
+        except (IOError, ValueError):
+            return _store_version(version)
+
+
+def diff_versions(old, new):
+    """Compares two baselines by their manifests.
+
+    Returns:
+        dict with sorted lists of relative paths under 'added', 'removed'
+        and 'changed'
+    """
+    a, b = get_manifest(old), get_manifest(new)
+    return {'added': sorted(set(b).difference(a)),
+            'removed': sorted(set(a).difference(b)),
+            'changed': sorted(f for f in set(a).intersection(b)
+                              if a[f] != b[f])}
+
+
+def _store_path(*parts):
+    """Returns a path in the baseline store."""
+    return paths.get('baselines', 'store', *parts)
+
+
+def _update_store(versions):
+    """Adds new baselines to the store, and forgets removed ones."""
+    for version in versions:
+        if not os.path.isfile(_store_path(version + '.json')):
+            _store_version(version)
+    removed = [f for f in glob.glob(_store_path('df_*.json'))
+               if os.path.basename(f)[:-5] not in versions]
+    for f in removed:
+        os.remove(f)
+    if removed:
+        # Blobs only linked from the store are no longer used by any version
+        for root, _, files in os.walk(_store_path('objects')):
+            for k in files:
+                if os.stat(os.path.join(root, k)).st_nlink == 1:
+                    os.remove(os.path.join(root, k))
+
+
+def _store_version(version):
+    """Moves the files of a baseline into the store, replacing them with
+    hard links, and writes its manifest. On file systems without hard links,
+    only the manifest is written."""
+    log.i('Adding baseline {} to the store'.format(version))
+    folder = paths.get('baselines', version)
+    manifest = filesync.hash_tree(folder)
+    for rel, digest in manifest.items():
+        path = os.path.join(folder, *rel.split('/'))
+        blob = _store_path('objects', digest[:2], digest)
+        try:
+            if not os.path.isfile(blob):
+                os.makedirs(os.path.dirname(blob), exist_ok=True)
+                os.link(path, blob)
+            elif not os.path.samefile(path, blob):
+                os.link(blob, path + '.tmp')
+                os.replace(path + '.tmp', path)
+        except OSError:
+            log.d('Could not link {} into the store'.format(path))
+    os.makedirs(_store_path(), exist_ok=True)
+    with open(_store_path(version + '.json'), 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    return manifest
+
+
+def invalidate(*_):
+    """Forgets the known baselines, so the folder is scanned again on next
+    use. Accepts and ignores any arguments, for use as a download callback."""
+    with _registry_lock:
+        _registry.clear()
+        _vanilla_manifests.clear()
+
+
 def prepare_baselines():
     """Unzip any DF releases found, and discard non-universal files."""
     archives = glob.glob(os.path.join(paths.get('baselines'), 'df_??_?*.???'))
@@ -57,42 +183,85 @@ def prepare_baselines():
             version = version.replace(s, '')
         f = paths.get('baselines', version)
         if not os.path.isdir(f):
+            # Extract next to the final folder, so an interrupted extraction
+            # is not mistaken for a complete baseline
+            staging = f + '.tmp'
+            if os.path.isdir(staging):
+                shutil.rmtree(staging)
             if item.endswith('.zip'):
-                with zipfile.ZipFile(item) as zipped:
-                    zipped.extractall(f)
+                _extract_zip(item, staging)
             elif item.endswith('.tar.bz2'):
-                with tarfile.TarFile(item) as tarred:
-                    tarred.extractall(f)
-                for k in glob.glob(os.path.join(f, 'df_*x', '*')):
-                    shutil.move(k, f)
-            simplify_pack(version, 'baselines')
+                _extract_tar(item, staging)
+            os.makedirs(staging, exist_ok=True)
+            os.rename(staging, f)
         os.remove(item)
 
 
+def _baseline_member(target, name, keep):
+    """Returns the path to extract archive member <name> to in <target>, or
+    None if the member is not kept in baselines (see `simplify_packs`).
+    Linux and OS X releases keep everything in a df_linux or df_osx folder,
+    which is left out."""
+    parts = [p for p in name.replace('\\', '/').split('/') if p]
+    if parts and fnmatch.fnmatch(parts[0], 'df_*x'):
+        parts = parts[1:]
+    if not parts or any(p in ('.', '..') for p in parts):
+        return None
+    if not _is_kept(parts, keep):
+        return None
+    return os.path.join(target, *parts)
+
+
+def _extract_zip(archive, target):
+    """Extracts the members of a zipped DF release needed for a baseline,
+    decompressing members in parallel."""
+    keep = _keep_tree('baselines')
+    with zipfile.ZipFile(archive) as zipped:
+        members = []
+        for info in zipped.infolist():
+            path = _baseline_member(target, info.filename, keep)
+            if path and not info.is_dir():
+                members.append((info, path))
+        for d in {os.path.dirname(path) for _, path in members}:
+            os.makedirs(d, exist_ok=True)
+
+        def extract(member):
+            """Writes one member to disk."""
+            with zipped.open(member[0]) as src, open(member[1], 'wb') as dst:
+                shutil.copyfileobj(src, dst)
+
+        with ThreadPoolExecutor() as pool:
+            list(pool.map(extract, members))
+    log.i('Extracted {} files from {}'.format(len(members), archive))
+
+
+def _extract_tar(archive, target):
+    """Extracts the members of a DF release tarball needed for a baseline,
+    reading the archive as a stream in a single pass."""
+    keep = _keep_tree('baselines')
+    count = 0
+    with tarfile.open(archive, 'r|bz2') as tarred:
+        for member in tarred:
+            path = _baseline_member(target, member.name, keep)
+            if not path or not member.isfile():
+                continue
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with tarred.extractfile(member) as src, open(path, 'wb') as dst:
+                shutil.copyfileobj(src, dst)
+            count += 1
+    log.i('Extracted {} files from {}'.format(count, archive))
+
+
 def set_auto_download(value):
     """Sets the option for auto-download of baselines."""
     lnp.userconfig['downloadBaselines'] = value
     lnp.userconfig.save_data()
 
 
-def simplify_pack(pack, folder):
-    """Removes unnecessary files from LNP/<folder>/<pack>.
-
-    Args:
-        pack, folder: path segments in ``'./LNP/folder/pack/'`` as strings
-
-    Returns:
-        The number of files removed if successful,
-        ``False`` if an exception occurred,
-        ``None`` if folder is empty
-    """
-    if folder not in ('graphics', 'mods', 'baselines'):
-        return False
-    log.i('Simplifying {}: {}'.format(folder, pack))
-    packdir = paths.get(folder, pack)
-    files_before = sum(len(f) for _, _, f in os.walk(packdir))
-    if files_before == 0:
-        return None
+def _keep_tree(folder):
+    """Returns the files and folders kept when simplifying, as a trie of
+    lowercase path elements: nested dicts, where ``True`` keeps the file or
+    everything in the folder."""
     keep = [('raw',), ('data', 'speech')]
     if folder == 'graphics':
         keep = [('raw', 'objects'), ('raw', 'graphics')]
@@ -102,69 +271,230 @@ def simplify_pack(pack, folder):
             ('colors', 'd_init', 'init', 'overrides')]
     if folder == 'baselines':
         keep.append(('data', 'init', 'interface.txt'))
-    keep = [os.path.join(*k) for k in keep]
-    for root, _, files in os.walk(packdir):
-        for k in files:
-            if k == 'manifest.json' or 'readme' in k.lower():
-                continue
-            f = os.path.join(root, k)
-            if not any(fnmatch.fnmatch(f, os.path.join(packdir, pattern, '*'))
-                       for pattern in keep):
-                os.remove(f)
-    files_after = sum(len(f) for _, _, f in os.walk(packdir))
-    log.v('Removed {} files'.format(files_before - files_after))
-    return files_before - files_after
+    tree = {}
+    for k in keep:
+        node = tree
+        for part in k[:-1]:
+            node = node.setdefault(part, {})
+        node[k[-1]] = True
+    return tree
+
+
+def is_kept(rel, folder):
+    """Returns True if simplifying a pack in LNP/<folder> would keep the file
+    at <rel>, a path relative to the pack."""
+    return _is_kept(os.path.normpath(rel).split(os.sep), _keep_tree(folder))
+
+
+def _is_kept(parts, keep):
+    """Returns True if the file at the relative path <parts> (a sequence of
+    path elements) should be kept when simplifying. Names are compared
+    without regard to case."""
+    name = parts[-1].lower()
+    if name == 'manifest.json' or 'readme' in name:
+        return True
+    for part in parts:
+        keep = keep.get(part.lower())
+        if not isinstance(keep, dict):
+            return bool(keep)
+    return False
 
 
-def remove_vanilla_raws_from_pack(pack, folder):
-    """Remove files identical to vanilla raws, return files removed
+def _prune(path, rel, keep, visit, stats):
+    """Simplifies the folder <path> in a single bottom-up scandir pass.
+
+    Files are removed unless kept by <keep> (the part of the trie from
+    `_keep_tree` for this folder), or if ``visit(rel, path)`` returns True
+    for a kept file. Folders left empty are removed as well.
 
     Args:
-        pack, folder: path segments in ``'./LNP/folder/pack/'`` as strings
+        path: the folder to simplify.
+        rel: the path elements of <path> relative to the pack.
+        keep: a trie node, or ``True`` to keep everything.
+        visit: callable for kept files, or None.
+        stats: a Counter updated with the number of files 'seen', and the
+            'files' and 'dirs' removed.
 
     Returns:
-        int: the number of files removed
+        True if <path> is empty afterwards.
     """
-    if not find_vanilla():
-        return 0
-    i = 0
-    for _folder, van_folder in (
-            [paths.get(folder, pack, 'raw'), find_vanilla_raws()],
-            [paths.get(folder, pack, 'data', 'speech'),
-             os.path.join(find_vanilla(), 'data', 'speech')]):
-        for root, _, files in os.walk(_folder):
-            for k in files:
-                f = os.path.join(root, k)
-                silently_kill = ('Thumbs.db', 'installed_raws.txt')
-                if any(f.endswith(x) for x in silently_kill):
-                    os.remove(f)
-                    continue
-                van_f = os.path.join(van_folder, os.path.relpath(f, _folder))
-                if os.path.isfile(van_f):
-                    with open(van_f, encoding='cp437', errors='replace') as v:
-                        vtext = v.read()
-                    with open(f, encoding='cp437', errors='replace') as m:
-                        mtext = m.read()
-                    if vtext == mtext:
-                        os.remove(f)
-                        i += 1
-    return i
+    left = 0
+    with os.scandir(path) as it:
+        entries = list(it)
+    for entry in entries:
+        parts = rel + (entry.name,)
+        if entry.is_dir(follow_symlinks=False):
+            child = keep
+            if keep is not True:
+                child = keep.get(entry.name.lower(), {})
+            if _prune(entry.path, parts, child, visit, stats):
+                os.rmdir(entry.path)
+                stats['dirs'] += 1
+                continue
+        else:
+            stats['seen'] += 1
+            if (keep is True or _is_kept((entry.name,), keep)) and not (
+                    visit and visit(parts, entry.path)):
+                left += 1
+            else:
+                os.remove(entry.path)
+                stats['files'] += 1
+            continue
+        left += 1
+    return not left
+
 
+def simplify_packs(packs, folder):
+    """Simplifies several packs in LNP/<folder> in parallel.
 
-def remove_empty_dirs(pack, folder):
-    """Removes empty subdirs in a mods or graphics pack.
+    Each pack is traversed once: files outside the kept folders are removed,
+    then raws identical to vanilla, then any directories left empty. For mods
+    which had many files removed, blank files are made for the missing
+    vanilla raws (vanilla files which are missing from a mod bundled
+    with other files are assumed to be deliberately omitted).
 
     Args:
-        pack, folder: path segments in ``'./LNP/folder/pack/'`` as strings
+        packs: names of the packs to simplify.
+        folder: 'mods' or 'graphics'
+
+    Returns:
+        dict of {pack: result}, where result is the number of files and
+        directories affected, ``None`` if the pack is empty, or ``False``
+        if an exception occurred.
+    """
+    vanilla = find_vanilla()
+    if vanilla:
+        # Store the baseline, if needed, before the workers look it up
+        _vanilla_manifest(vanilla)
+    start = time.perf_counter()
+    with ThreadPoolExecutor() as pool:
+        done = dict(zip(packs, pool.map(
+            lambda p: _simplify_one(p, folder, vanilla), packs)))
+    seconds = time.perf_counter() - start
+    results = {p: r and r[0] for p, r in done.items()}
+    files, size = (sum(r[i] for r in done.values() if r) for i in (1, 2))
+    log.i('Simplified {} {}: {} files affected; compared {} files ({:.1f} MB) '
+          'to vanilla in {:.2f}s ({:.1f} MB/s)'.format(
+              len(results), folder, sum(r or 0 for r in results.values()),
+              files, size / 1e6, seconds, size / 1e6 / max(seconds, 1e-6)))
+    return results
+
+
+def _simplify_one(pack, folder, vanilla):
+    """Simplifies one pack with a single traversal. See `simplify_packs`.
 
     Returns:
-        int: the number of dirs removed
+        (files affected, files compared to vanilla, bytes compared), or
+        ``None`` or ``False`` as for `simplify_packs`.
     """
-    i = 0
-    for _ in range(3):
-        # only catches the lowest level each iteration
-        for root, dirs, files in os.walk(paths.get(folder, pack)):
-            if not dirs and not files:
-                os.rmdir(root)
-                i += 1
+    packdir = paths.get(folder, pack)
+    kept, stats = [], Counter()
+
+    def visit(parts, path):
+        """Returns True to remove a kept file identical to vanilla."""
+        kept.append(path)
+        if not vanilla or parts[0].lower() != 'raw' and [
+                p.lower() for p in parts[:2]] != ['data', 'speech']:
+            return False
+        if parts[-1] in ('Thumbs.db', 'installed_raws.txt'):
+            stats['dropped'] += 1
+            return True
+        van_f = paths.resolve(vanilla, os.path.join(*parts))
+        if not os.path.isfile(van_f):
+            return False
+        st = os.stat(path)
+        stats.update(compared=1, bytes=st.st_size)
+        if same_as_vanilla(path, van_f, vanilla, st):
+            stats['dropped'] += 1
+            return True
+        return False
+
+    try:
+        if not os.path.isdir(packdir):
+            return None
+        if _prune(packdir, (), _keep_tree(folder), visit, stats):
+            os.rmdir(packdir)
+            stats['dirs'] += 1
+        if not stats['seen']:
+            return None
+        log.i('Simplifying {}: {}'.format(folder, pack))
+        count = stats['files'] + stats['dirs']
+        if vanilla and folder == 'mods' and stats['files'] - stats[
+                'dropped'] > 10:
+            log.w('Reducing mod "{}": assume vanilla files were omitted '
+                  'deliberately'.format(pack))
+            count += _make_blank_files(packdir, kept, vanilla)
+    except Exception:
+        log.e('Could not simplify ' + packdir, stack=True)
+        return False
+    return count, stats['compared'], stats['bytes']
+
+
+def _make_blank_files(packdir, kept, vanilla):
+    """Creates blank files in <packdir> for vanilla raws missing from <kept>,
+    returning the number created."""
+    i, kept = 0, {os.path.normpath(f).lower() for f in kept}
+    van_raws = os.path.join(vanilla, 'raw')
+    for root, _, files in os.walk(van_raws):
+        target = os.path.join(packdir, 'raw', os.path.relpath(root, van_raws))
+        for k in files:
+            f = os.path.normpath(os.path.join(target, k))
+            if f.lower() not in kept:
+                os.makedirs(target, exist_ok=True)
+                with open(f, 'w', encoding='utf-8'):
+                    i += 1
     return i
+
+
+def same_as_vanilla(path, van_f, vanilla, st=None):
+    """Returns True if <path> has the same text as the vanilla file <van_f>.
+
+    Files are compared as bytes, ignoring the difference between Windows and
+    Unix line endings. Equal sizes are checked against the hash in the
+    baseline manifest first; vanilla files are only read when that fails,
+    and their digests are then kept for the rest of the session.
+
+    Args:
+        path: the file to check.
+        van_f: the matching file in the vanilla baseline.
+        vanilla: path to the vanilla baseline folder.
+        st: the result of ``os.stat(path)``, if already known.
+    """
+    if st is None:
+        st = os.stat(path)
+    van_st = os.stat(van_f)
+    if st.st_size == van_st.st_size:
+        rel = os.path.relpath(van_f, vanilla).replace(os.sep, '/')
+        digest = _vanilla_manifest(vanilla).get(rel)
+        if filesync.hash_file(path, st) == (
+                digest or filesync.hash_file(van_f, van_st)):
+            return True
+    key = (van_f, van_st.st_size, van_st.st_mtime_ns)
+    if key not in _vanilla_hashes:
+        with open(van_f, 'rb') as v:
+            _vanilla_hashes[key] = _text_digest(v.read())
+    van_len, van_digest = _vanilla_hashes[key]
+    # Normalizing line endings can only make a file shorter
+    if st.st_size < van_len or (st.st_size == van_len == van_st.st_size):
+        return False
+    with open(path, 'rb') as m:
+        return _text_digest(m.read()) == (van_len, van_digest)
+
+
+def _vanilla_manifest(vanilla):
+    """Returns the store manifest for the baseline in <vanilla>, or an empty
+    dict if it is not a stored baseline."""
+    version = os.path.basename(os.path.normpath(vanilla))
+    with _registry_lock:
+        if version not in _vanilla_manifests:
+            try:
+                _vanilla_manifests[version] = get_manifest(version)
+            except OSError:
+                _vanilla_manifests[version] = {}
+        return _vanilla_manifests[version]
+
+
+def _text_digest(data):
+    """Returns (length, digest) of <data> with line endings normalized."""
+    data = data.replace(b'\r\n', b'\n').replace(b'\r', b'\n')
+    return len(data), hashlib.sha1(data).hexdigest()
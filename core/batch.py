@@ -0,0 +1,122 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Headless command-line modes for building packs without the UI.
+
+Results are printed to stdout as JSON; log output goes to stderr."""
+
+import json
+import sys
+import time
+
+from . import graphics, log, mods, paths, rebase
+
+# Exit codes
+OK = 0
+FAILED = 1
+CONFLICTS = 2
+
+
+def is_requested(args):
+    """Returns True if the command line asks for a headless mode."""
+    return bool(args.merge_mods is not None or args.simplify
+                or args.install_graphics or args.rebase_mods)
+
+
+def run(args):
+    """Runs the requested headless modes in order, prints the results as
+    JSON and returns the exit code.
+
+    Phases run in this order: rebase mods, simplify, install graphics, merge
+    mods, install mods, update saves. A failed phase, including one that
+    raises an exception, skips the ones after it.
+    """
+    result = {'phases': [], 'status': OK}
+    if not paths.get('df'):
+        log.e('No Dwarf Fortress folder selected')
+        result['status'] = FAILED
+    phases = []
+    if args.rebase_mods:
+        phases.append(('rebase-mods', lambda: _rebase(*args.rebase_mods)))
+    if args.simplify:
+        phases.append(('simplify', _simplify))
+    if args.install_graphics:
+        phases.append(('install-graphics',
+                       lambda: _install_graphics(args.install_graphics)))
+    if args.merge_mods is not None:
+        mod_list = [m for m in args.merge_mods.split(',') if m]
+        phases.append(('merge-mods', lambda: _merge(mod_list, args.gfx)))
+        if args.install:
+            phases.append(('install', _install))
+        if args.update_saves:
+            phases.append(('update-saves', _update_saves))
+    for name, fn in phases:
+        if result['status'] != OK:
+            break
+        start = time.perf_counter()
+        try:
+            status, data = fn()
+        except Exception as e:
+            log.e('Phase {} failed'.format(name), stack=True)
+            status, data = FAILED, {'error': repr(e)}
+        result['phases'].append({
+            'name': name, 'seconds': round(time.perf_counter() - start, 4),
+            'status': status, 'result': data})
+        result['status'] = status
+    result['seconds'] = round(sum(p['seconds'] for p in result['phases']), 4)
+    json.dump(result, sys.stdout, indent=2)
+    sys.stdout.write('\n')
+    return result['status']
+
+
+def _rebase(old, new):
+    """Rebases all mods from one baseline to another."""
+    results = rebase.rebase_mods(mods.read_mods(), old, new)
+    if results is None:
+        return FAILED, None
+    statuses = [r['status'] for r in results.values()]
+    if 3 in statuses:
+        return FAILED, results
+    if 2 in statuses:
+        return CONFLICTS, results
+    return OK, results
+
+
+def _simplify():
+    """Simplifies all mods and graphics packs."""
+    m, f = mods.simplify_mods()
+    g, h = graphics.simplify_graphics()
+    return OK, {'mods': m, 'mod_files': f, 'graphics': g, 'graphics_files': h}
+
+
+def _install_graphics(pack):
+    """Installs a graphics pack, updating the installed raws."""
+    if graphics.install_graphics(pack):
+        return OK, {'pack': pack}
+    return FAILED, {'pack': pack}
+
+
+def _merge(mod_list, gfx):
+    """Merges mods into LNP/Baselines/temp."""
+    statuses = mods.merge_all_mods(mod_list, gfx)
+    data = {'mods': dict(zip(mod_list, statuses)),
+            'conflicts': {m: len(c) for m, c in mods.get_conflicts().items()
+                          if c}}
+    if -1 in statuses:
+        return FAILED, data
+    if max(statuses + [0]) >= 2:
+        return CONFLICTS, data
+    return OK, data
+
+
+def _install():
+    """Installs the merged raws."""
+    report = mods.install_mods()
+    if not report:
+        return FAILED, None
+    return OK, dict(report._asdict())
+
+
+def _update_saves():
+    """Updates save games to the installed raws."""
+    count, skipped = graphics.update_savegames()
+    return OK, {'updated': count, 'skipped': skipped}
@@ -46,6 +46,9 @@ init_filename_parents = {
 # Do not allow parent tags to go under these tags
 final_level_tags = ['TILE_PAGE']
 
+# Matches a tag, capturing the name and the value (including the colon)
+_tag_re = re.compile(r'\[([^\]:]+)(:[^\]]*)?\]')
+
 
 def tokenize_raw(text):
     """Generator which returns nodes from a raw file.
@@ -119,6 +122,45 @@ def parse_raw(parent, text):
             raise Exception('Unknown raw token kind: ' + kind)
 
 
+def split_objects(lines):
+    """Splits the lines of an object raw file into top-level objects, using
+    the same parent tags as the DFRaw parser (eg ``[CREATURE:X]``).
+
+    Args:
+        lines: the lines of a file in raw/objects.
+
+    Returns:
+        A list of (key, lines) tuples in file order, where key is the text of
+        the parent tag (eg ``'CREATURE:DWARF'``) and the first key is the
+        empty string for anything before the first object. Returns None if the
+        file cannot be split unambiguously (no [OBJECT] tag, several objects
+        starting on one line, or duplicate object names).
+    """
+    parent_tags, is_object = [], False
+    result = [('', [])]
+    seen = set()
+    for line in lines:
+        starts = []
+        for name, value in _tag_re.findall(line):
+            if name == 'OBJECT':
+                if value[1:] not in object_parents:
+                    return None
+                parent_tags, is_object = object_parents[value[1:]], True
+            elif any(fnmatch(name, g) for g in parent_tags):
+                starts.append(name + value)
+        if len(starts) > 1:
+            return None
+        if starts:
+            if starts[0] in seen:
+                return None
+            seen.add(starts[0])
+            result.append((starts[0], []))
+        result[-1][1].append(line)
+    if not is_object:
+        return None
+    return result
+
+
 class DFRawNode(object):
     """Class representing a node in a raw file."""
     def __init__(self, parent, node_id, value, node_type, **kwargs):
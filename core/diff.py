@@ -0,0 +1,269 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Line diffing backends used when merging mods.
+
+All backends return opcodes in the format produced by
+``difflib.SequenceMatcher.get_opcodes``, ie a list of tuples
+``(tag, i1, i2, j1, j2)`` covering both sequences from start to end.
+"""
+
+from bisect import bisect_left
+from collections import Counter
+from difflib import SequenceMatcher
+
+from . import log
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# Below this many lines, a plain Python loop beats converting to arrays
+_NUMPY_THRESHOLD = 2048
+# Regions needing more edits than this are diffed by difflib instead; the
+# cost of finding a middle snake grows with the square of the edit count
+_MYERS_MAX_COST = 64
+
+# Selected by the 'diff_backend' user setting; see mods.toggle_patience_diff
+_backend = 'difflib'
+
+# Region helpers take (a, alo, ahi, b, blo, bhi) like difflib does internally
+# pylint:disable=too-many-arguments,too-many-positional-arguments
+
+
+def get_opcodes(a, b, backend=None):
+    """Returns opcodes describing how to turn the lines in <a> into <b>.
+
+    Args:
+        a, b: sequences of lines (or any other hashable items)
+        backend: name of the backend to use; see ``BACKENDS``.
+            Defaults to the backend selected with `set_backend`.
+    """
+    return BACKENDS[backend or _backend](a, b)
+
+
+def set_backend(name):
+    """Selects the default diff backend. Unknown names are ignored."""
+    # pylint:disable=global-statement
+    global _backend
+    if name in BACKENDS:
+        _backend = name
+    else:
+        log.w('Unknown diff backend: ' + str(name))
+
+
+def get_backend():
+    """Returns the name of the default diff backend."""
+    return _backend
+
+
+def difflib_opcodes(a, b):
+    """Diffs using difflib.SequenceMatcher; slow on large or repetitive files."""
+    return SequenceMatcher(None, a, b).get_opcodes()
+
+
+def patience_opcodes(a, b):
+    """Diffs using patience anchors, falling back to Myers' algorithm for
+    regions without unique lines. Lines are mapped to integers first, so all
+    comparisons after that are between small ints."""
+    ids = {}
+    a = [ids.setdefault(line, len(ids)) for line in a]
+    b = [ids.setdefault(line, len(ids)) for line in b]
+    blocks = []
+    _patience(a, 0, len(a), b, 0, len(b), blocks)
+    return _opcodes_from_blocks(blocks, len(a), len(b))
+
+
+def _common_prefix(a, alo, ahi, b, blo, bhi):
+    """Returns the length of the common prefix of a[alo:ahi] and b[blo:bhi]."""
+    n = min(ahi - alo, bhi - blo)
+    if numpy is not None and n > _NUMPY_THRESHOLD:
+        diff = numpy.flatnonzero(numpy.asarray(a[alo:alo + n])
+                                 != numpy.asarray(b[blo:blo + n]))
+        return int(diff[0]) if diff.size else n
+    i = 0
+    while i < n and a[alo + i] == b[blo + i]:
+        i += 1
+    return i
+
+
+def _common_suffix(a, alo, ahi, b, blo, bhi):
+    """Returns the length of the common suffix of a[alo:ahi] and b[blo:bhi]."""
+    n = min(ahi - alo, bhi - blo)
+    if numpy is not None and n > _NUMPY_THRESHOLD:
+        diff = numpy.flatnonzero(numpy.asarray(a[ahi - n:ahi][::-1])
+                                 != numpy.asarray(b[bhi - n:bhi][::-1]))
+        return int(diff[0]) if diff.size else n
+    i = 0
+    while i < n and a[ahi - 1 - i] == b[bhi - 1 - i]:
+        i += 1
+    return i
+
+
+def _patience(a, alo, ahi, b, blo, bhi, blocks):
+    """Appends matching blocks (i, j, n) for a[alo:ahi] and b[blo:bhi] to
+    <blocks>, in order."""
+    prefix = _common_prefix(a, alo, ahi, b, blo, bhi)
+    if prefix:
+        blocks.append((alo, blo, prefix))
+        alo += prefix
+        blo += prefix
+    suffix = _common_suffix(a, alo, ahi, b, blo, bhi)
+    ahi -= suffix
+    bhi -= suffix
+    if alo < ahi and blo < bhi:
+        anchors = _unique_anchors(a, alo, ahi, b, blo, bhi)
+        if anchors:
+            i, j = alo, blo
+            for ai, bj in anchors:
+                _patience(a, i, ai, b, j, bj, blocks)
+                blocks.append((ai, bj, 1))
+                i, j = ai + 1, bj + 1
+            _patience(a, i, ahi, b, j, bhi, blocks)
+        else:
+            blocks.extend(_myers(a, alo, ahi, b, blo, bhi))
+    if suffix:
+        blocks.append((ahi, bhi, suffix))
+
+
+def _unique_anchors(a, alo, ahi, b, blo, bhi):  # pylint:disable=too-many-locals
+    """Returns the longest increasing sequence of (i, j) pairs where a[i] ==
+    b[j] and the line occurs exactly once in each region."""
+    count_a = Counter(a[alo:ahi])
+    count_b = Counter(b[blo:bhi])
+    b_index = {b[j]: j for j in range(blo, bhi)
+               if count_b[b[j]] == 1 and count_a[b[j]] == 1}
+    pairs = [(i, b_index[a[i]]) for i in range(alo, ahi) if a[i] in b_index]
+    if not pairs:
+        return []
+    # Patience sorting: longest increasing subsequence on j
+    tails, tail_idx, prev = [], [], [None] * len(pairs)
+    for n, (_, j) in enumerate(pairs):
+        k = bisect_left(tails, j)
+        if k:
+            prev[n] = tail_idx[k - 1]
+        if k == len(tails):
+            tails.append(j)
+            tail_idx.append(n)
+        else:
+            tails[k] = j
+            tail_idx[k] = n
+    result, n = [], tail_idx[-1]
+    while n is not None:
+        result.append(pairs[n])
+        n = prev[n]
+    return result[::-1]
+
+
+def _myers(a, alo, ahi, b, blo, bhi):
+    """Returns matching blocks for a[alo:ahi] and b[blo:bhi] using Myers'
+    linear-space algorithm, splitting on the middle snake of each region.
+
+    Regions that are too far apart to split cheaply are handed to difflib."""
+    blocks = []
+    todo = [(alo, ahi, blo, bhi)]
+    while todo:
+        alo, ahi, blo, bhi = todo.pop()
+        if alo == ahi or blo == bhi:
+            continue
+        prefix = _common_prefix(a, alo, ahi, b, blo, bhi)
+        if prefix:
+            blocks.append((alo, blo, prefix))
+            alo += prefix
+            blo += prefix
+        suffix = _common_suffix(a, alo, ahi, b, blo, bhi)
+        if suffix:
+            blocks.append((ahi - suffix, bhi - suffix, suffix))
+            ahi -= suffix
+            bhi -= suffix
+        if alo == ahi or blo == bhi:
+            continue
+        snake = _middle_snake(a, alo, ahi, b, blo, bhi)
+        if snake is None:
+            blocks.extend(
+                (alo + i, blo + j, size) for i, j, size in SequenceMatcher(
+                    None, a[alo:ahi], b[blo:bhi]).get_matching_blocks())
+            continue
+        x0, y0, x1, y1 = snake
+        if x1 > x0:
+            blocks.append((alo + x0, blo + y0, x1 - x0))
+        todo.append((alo, alo + x0, blo, blo + y0))
+        todo.append((alo + x1, ahi, blo + y1, bhi))
+    blocks.sort()
+    return blocks
+
+
+def _middle_snake(a, alo, ahi, b, blo, bhi):  # pylint:disable=too-many-locals
+    """Returns the middle snake (x0, y0, x1, y1) of an optimal path through
+    a[alo:ahi] and b[blo:bhi], relative to alo and blo, or None if the
+    regions differ by more than ``_MYERS_MAX_COST`` edits.
+
+    The regions must differ in both their first and last lines."""
+    n, m = ahi - alo, bhi - blo
+    delta = n - m
+    odd = delta % 2
+    # Furthest x reached on each diagonal, forwards from the start and
+    # backwards from the end
+    forward, backward = {1: 0}, {1: 0}
+    for d in range(min((n + m + 1) // 2, _MYERS_MAX_COST) + 1):
+        for k in range(-d, d + 1, 2):
+            if k == -d or (k != d and forward[k - 1] < forward[k + 1]):
+                x = forward[k + 1]
+            else:
+                x = forward[k - 1] + 1
+            x0, y0 = x, x - k
+            while x < n and x - k < m and a[alo + x] == b[blo + x - k]:
+                x += 1
+            forward[k] = x
+            if odd and -d < delta - k < d and x + backward[delta - k] >= n:
+                return x0, y0, x, x - k
+        for k in range(-d, d + 1, 2):
+            if k == -d or (k != d and backward[k - 1] < backward[k + 1]):
+                x = backward[k + 1]
+            else:
+                x = backward[k - 1] + 1
+            x0 = x
+            while x < n and x - k < m \
+                    and a[ahi - 1 - x] == b[bhi - 1 - x + k]:
+                x += 1
+            backward[k] = x
+            if not odd and -d <= delta - k <= d \
+                    and x + forward[delta - k] >= n:
+                return n - x, m - x + k, n - x0, m - x0 + k
+    return None
+
+
+def _opcodes_from_blocks(blocks, la, lb):
+    """Converts ordered matching blocks to SequenceMatcher-style opcodes."""
+    merged = []
+    for block in blocks:
+        if not block[2]:
+            continue
+        if merged and merged[-1][0] + merged[-1][2] == block[0] \
+                and merged[-1][1] + merged[-1][2] == block[1]:
+            merged[-1] = (merged[-1][0], merged[-1][1],
+                          merged[-1][2] + block[2])
+        else:
+            merged.append(block)
+    merged.append((la, lb, 0))
+    opcodes, i, j = [], 0, 0
+    for ai, bj, size in merged:
+        tag = ''
+        if i < ai and j < bj:
+            tag = 'replace'
+        elif i < ai:
+            tag = 'delete'
+        elif j < bj:
+            tag = 'insert'
+        if tag:
+            opcodes.append((tag, i, ai, j, bj))
+        i, j = ai + size, bj + size
+        if size:
+            opcodes.append(('equal', ai, i, bj, j))
+    return opcodes
+
+
+BACKENDS = {
+    'difflib': difflib_opcodes,
+    'patience': patience_opcodes,
+}
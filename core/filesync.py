@@ -0,0 +1,155 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Delta copying of folder trees, swapped into place in one step."""
+
+import hashlib
+import os
+import shutil
+from collections import namedtuple
+
+from . import log
+
+# Digests by path, valid while (size, mtime) is unchanged
+_hashes = {}
+
+
+class SyncReport(namedtuple('SyncReport', ['files', 'bytes', 'unchanged'])):
+    """Files and bytes written by a sync, and unchanged files kept."""
+    __slots__ = ()
+
+    def __add__(self, other):
+        return SyncReport(*(a + b for a, b in zip(self, other)))
+
+
+def hash_file(path, st=None):
+    """Returns the SHA-1 digest of a file, cached by size and mtime."""
+    if st is None:
+        st = os.stat(path)
+    key = (st.st_size, st.st_mtime_ns)
+    cached = _hashes.get(path)
+    if cached and cached[0] == key:
+        return cached[1]
+    h = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 16), b''):
+            h.update(block)
+    _hashes[path] = (key, h.hexdigest())
+    return h.hexdigest()
+
+
+def tree_hash(folder):
+    """Returns a SHA-1 digest of the names and contents of all files in
+    <folder>; missing folders hash like empty ones."""
+    h = hashlib.sha1()
+    for rel, path in sorted(_walk_files(folder)):
+        h.update(rel.encode('utf-8') + b'\0' + hash_file(path).encode('ascii'))
+    return h.hexdigest()
+
+
+def hash_tree(folder, exclude=()):
+    """Returns a dict of {relative path: digest} for the files in <folder>,
+    using '/' as the path separator. Top-level files named in <exclude> are
+    left out."""
+    return {rel: hash_file(path) for rel, path in _walk_files(folder)
+            if rel not in exclude}
+
+
+def _walk_files(folder):
+    """Yields (relative path, path) for each file in <folder>."""
+    for root, _, files in os.walk(folder):
+        for f in files:
+            path = os.path.join(root, f)
+            yield os.path.relpath(path, folder).replace(os.sep, '/'), path
+
+
+def same_file(src, dst, src_st, dst_st):
+    """Returns True if <src> and <dst> have the same contents, comparing size
+    and mtime before falling back to hashes."""
+    if src_st.st_size != dst_st.st_size:
+        return False
+    if src_st.st_mtime_ns == dst_st.st_mtime_ns:
+        return True
+    return hash_file(src, src_st) == hash_file(dst, dst_st)
+
+
+def sync_tree(src, dst):
+    """Makes <dst> an exact copy of <src>, only copying changed files.
+
+    The new tree is built next to <dst>, with unchanged files hard linked
+    from <dst>, and then renamed into place; if anything fails before that,
+    <dst> is left untouched.
+
+    Returns:
+        a SyncReport of the files and bytes written.
+    """
+    return sync_files(list_files(src), dst)
+
+
+def sync_files(files, dst):
+    """Makes <dst> hold exactly the given files, only copying changed ones.
+    Works like `sync_tree`, but the files can come from several folders.
+
+    Args:
+        files: dict of {relative path: source path}, using '/' as the path
+            separator. A source may be the file already in <dst>.
+        dst: the folder to update.
+
+    Returns:
+        a SyncReport of the files and bytes written.
+    """
+    dst = os.path.normpath(dst)
+    staging, old = dst + '.sync-new', dst + '.sync-old'
+    for d in (staging, old):
+        if os.path.exists(d):
+            shutil.rmtree(d)
+    try:
+        report = _stage(files, dst, staging)
+        if os.path.exists(dst):
+            os.rename(dst, old)
+        try:
+            os.rename(staging, dst)
+        except OSError:
+            if os.path.exists(old):
+                os.rename(old, dst)
+            raise
+    except Exception:
+        shutil.rmtree(staging, ignore_errors=True)
+        raise
+    shutil.rmtree(old, ignore_errors=True)
+    log.i('Synced {}: {} files ({} bytes) written, {} unchanged'.format(
+        dst, *report))
+    return report
+
+
+def list_files(folder):
+    """Returns a dict of {relative path: path} for the files in <folder>,
+    using '/' as the path separator."""
+    return dict(_walk_files(folder))
+
+
+def _stage(files, dst, staging):
+    """Builds the tree for `sync_files` in <staging>, linking files from
+    <dst> where they are unchanged."""
+    report = SyncReport(0, 0, 0)
+    os.makedirs(staging)
+    for rel, s in sorted(files.items()):
+        d = os.path.join(dst, *rel.split('/'))
+        target = os.path.join(staging, *rel.split('/'))
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        s_st = os.stat(s)
+        if os.path.isfile(d) and same_file(s, d, s_st, os.stat(d)) \
+                and _link(d, target):
+            report += SyncReport(0, 0, 1)
+        else:
+            shutil.copy2(s, target)
+            report += SyncReport(1, s_st.st_size, 0)
+    return report
+
+
+def _link(src, dst):
+    """Hard links <src> to <dst>, returning False if that is not possible."""
+    try:
+        os.link(src, dst)
+        return True
+    except OSError:
+        return False
@@ -0,0 +1,523 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Change footprints of mods against the vanilla baseline, used to find
+conflicts between mods without merging them."""
+
+import hashlib
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock
+
+from . import baselines, diff, filesync, log, paths
+
+# File types handled by mods.merge_folder
+TEXT_TYPES = ('.txt', '.init')
+BINARY_TYPES = ('.lua', '.rb', '.bmp', '.png')
+
+# Bump when the layout of footprint entries changes, to invalidate the cache
+_FORMAT = b'2'
+
+_cache = {}
+_cache_loaded = False
+_lock = Lock()
+# Footprints checked against the mods' files this session, as {mod: footprint}
+_checked = {}
+
+
+def cache_file():
+    """Returns the path of the on-disk footprint cache."""
+    return paths.get('baselines', 'cache', 'footprints.json')
+
+
+def mod_folders(mod, vanilla):
+    """Returns the (folder, vanilla folder, prefix) tuples merged for <mod>
+    against the baseline in <vanilla>."""
+    return [(paths.resolve(paths.get('mods', mod), 'raw'),
+             os.path.join(vanilla, 'raw'), 'raw'),
+            (paths.resolve(paths.get('mods', mod), 'data/speech'),
+             os.path.join(vanilla, 'data', 'speech'), 'data/speech')]
+
+
+def get_footprint(mod, folders=None):
+    """Returns the footprint of a mod: the files it touches and, for text
+    files, the vanilla line ranges it changes.
+
+    Footprints are cached by the mod's content hash, the baseline and the diff
+    backend, so unchanged mods are only diffed once.
+
+    Args:
+        mod: name of the mod, or any other identifier if <folders> is given.
+        folders: list of (folder, vanilla folder, prefix) tuples to compare;
+            defaults to the mod's raw and speech folders.
+
+    Returns:
+        dict of ``{file: entry}``, where file is eg ``'raw/objects/x.txt'``
+        and entry is a dict with keys:
+
+            kind: 'text', 'new' (text with no vanilla file) or 'binary'
+            hash: content hash of the file
+            vanilla_hash: hash of the vanilla file, or None ('binary' only)
+            lines: number of lines (text files only)
+            vanilla_lines: number of vanilla lines ('text' only)
+            ranges: list of changed vanilla ranges [start, end] ('text' only);
+                empty if the file is identical to vanilla
+
+        Returns None if the baseline is unavailable.
+    """
+    vanilla = baselines.find_vanilla(False)
+    if not vanilla:
+        return None
+    if folders is None:
+        folders = mod_folders(mod, vanilla)
+    files = _list_files(folders)
+    key = _content_key(files, folders)
+    _load_cache()
+    with _lock:
+        cached = _cache.get(mod)
+    if cached and cached['key'] == key:
+        result = cached['files']
+    else:
+        log.d('Computing footprint of ' + mod)
+        result = {}
+        for rel, path, van_f in files:
+            result[rel] = _file_entry(path, van_f)
+    with _lock:
+        _cache[mod] = {'key': key, 'files': result}
+        _checked[mod] = result
+    return result
+
+
+def known_footprint(mod):
+    """Returns the footprint of <mod> if it was computed or checked earlier
+    this session, or None. Reads no files, so it is safe to call from UI
+    code."""
+    with _lock:
+        return _checked.get(mod)
+
+
+def get_footprints(mods, progress=None):
+    """Returns a dict of {mod: footprint} for the given mods, computing
+    missing footprints in parallel and saving the cache afterwards.
+
+    Args:
+        mods: list of mod names.
+        progress: optional function(done, total) called as mods finish.
+    """
+    result = {}
+    if not mods:
+        return result
+    with ThreadPoolExecutor(max_workers=min(len(mods), os.cpu_count() or 1)) \
+            as pool:
+        for i, (mod, fp) in enumerate(zip(mods, pool.map(get_footprint, mods))):
+            result[mod] = fp
+            if progress:
+                progress(i + 1, len(mods))
+    save_cache()
+    return result
+
+
+def compare(fp_a, fp_b):
+    """Returns a dict of {file: overlapping hunks} for two footprints.
+
+    Text files with a vanilla counterpart conflict where their changed ranges
+    overlap. Text files without one are merged two-way, which never
+    conflicts; binary files conflict if both mods provide different contents.
+    """
+    result = {}
+    for f in set(fp_a).intersection(fp_b):
+        a, b = fp_a[f], fp_b[f]
+        if a['hash'] == b['hash'] or a['kind'] == b['kind'] == 'new':
+            continue
+        if a['kind'] == 'text' and b['kind'] == 'text':
+            n = count_overlaps(a['ranges'], b['ranges'])
+        else:
+            n = 1
+        if n:
+            result[f] = n
+    return result
+
+
+def count_overlaps(ranges_a, ranges_b):
+    """Counts pairs of overlapping ranges between two sorted range lists.
+    Insertions (empty ranges) overlap anything they touch."""
+    n, j = 0, 0
+    for a in ranges_a:
+        while j < len(ranges_b) and ranges_b[j][1] < a[0]:
+            j += 1
+        k = j
+        while k < len(ranges_b) and ranges_b[k][0] <= a[1]:
+            b = ranges_b[k]
+            if a[0] == a[1] or b[0] == b[1] or (a[0] < b[1] and b[0] < a[1]):
+                n += 1
+            k += 1
+    return n
+
+
+def conflict_matrix(mods=None, confirm=False):
+    """Computes pairwise conflicts between mods.
+
+    Args:
+        mods: list of mod names; defaults to all available mods.
+        confirm: if True, text files whose changed ranges overlap are merged
+            (the later mod over the earlier one) to check that the overlap
+            really gives status 2; see `confirm_conflicts`.
+
+    Returns:
+        dict of ``{(mod_a, mod_b): {file: overlapping hunks}}`` for each
+        pair of mods (in list order) that conflict.
+    """
+    if mods is None:
+        from . import mods as _mods
+        mods = _mods.read_mods()
+    fps = get_footprints(mods)
+    result = {}
+    for i, a in enumerate(mods):
+        for b in mods[i + 1:]:
+            if fps[a] is None or fps[b] is None:
+                continue
+            found = compare(fps[a], fps[b])
+            if found and confirm:
+                found = confirm_conflicts(a, b, found, fps[a], fps[b])
+            if found:
+                result[(a, b)] = found
+    return result
+
+
+def confirm_conflicts(mod_a, mod_b, found, fp_a, fp_b):
+    """Returns the part of <found> (see `compare`) where merging <mod_b>
+    over <mod_a> gives status 2.
+
+    Overlapping ranges are only a hint: the line merge accepts many changes
+    next to each other, so text files are merged to check.
+    """
+    from . import mods
+    vanilla = baselines.find_vanilla(False)
+    result = {}
+    for f, hunks in found.items():
+        if fp_a[f]['kind'] == fp_b[f]['kind'] == 'text':
+            try:
+                mod_a_lines, mod_b_lines, van_lines = (mods.read_lines(
+                    paths.resolve(folder, f)) for folder in (
+                        paths.get('mods', mod_a), paths.get('mods', mod_b),
+                        vanilla))
+            except IOError:
+                log.d('Could not read {} to confirm overlap'.format(f))
+            else:
+                if mods.merge_line_list(mod_b_lines, van_lines, mod_a_lines,
+                                        filename=f)[0] < 2:
+                    continue
+        result[f] = hunks
+    return result
+
+
+def conflicts_with(mod, others):
+    """Returns the subset of <others> which conflict with <mod>, using only
+    footprints computed earlier (see `get_footprints`). Returns None if any of
+    them are still pending."""
+    others = [o for o in others if o != mod]
+    fps = [known_footprint(m) for m in [mod] + others]
+    if None in fps:
+        return None
+    return [o for o, fp in zip(others, fps[1:]) if compare(fps[0], fp)]
+
+
+def suggest_order(mods):
+    """Suggests an order for <mods> which gives the fewest mods with
+    overlapping changes, without touching the merge folder.
+
+    The conflict graph only links mods where merging the later one over the
+    earlier one gives status 2 (see `confirm_conflicts`). A mod only overlaps
+    with mods merged before it, so the mods which merge cleanly with each
+    other form an independent set in the conflict graph. The
+    largest such set is found by branch and bound on each connected component
+    and placed first. The total number of overlapping hunks does not depend
+    on the order, so ties are broken by keeping the given order.
+
+    Returns:
+        tuple of (order, predicted status 2 count, overlapping hunks).
+    """
+    matrix = conflict_matrix(mods, confirm=True)
+    adj = {m: set() for m in mods}
+    for a, b in matrix:
+        adj[a].add(b)
+        adj[b].add(a)
+    index = {m: i for i, m in enumerate(mods)}
+    clean = set()
+    seen = set()
+    for m in mods:
+        if m in seen:
+            continue
+        component = _component(m, adj)
+        seen.update(component)
+        clean.update(_max_independent(component, adj, index))
+    order = ([m for m in mods if m in clean] +
+             [m for m in mods if m not in clean])
+    hunks = sum(sum(v.values()) for v in matrix.values())
+    return order, len(mods) - len(clean), hunks
+
+
+def _component(start, adj):
+    """Returns the set of nodes connected to <start>."""
+    found, todo = {start}, [start]
+    while todo:
+        for n in adj[todo.pop()]:
+            if n not in found:
+                found.add(n)
+                todo.append(n)
+    return found
+
+
+def _max_independent(nodes, adj, index):
+    """Returns a maximum independent set of <nodes>. Among the sets of equal
+    size that are found, the one coming first in <index> is kept."""
+    best = [sorted(_greedy_independent(nodes, adj, index), key=index.get)]
+
+    def search(remaining, chosen):
+        """Branches on the highest-degree node of <remaining>."""
+        remaining = set(remaining)
+        chosen = list(chosen)
+        # Nodes with at most one neighbour left are always safe to take
+        while True:
+            simple = [n for n in remaining if len(adj[n] & remaining) <= 1]
+            if not simple:
+                break
+            n = min(simple, key=index.get)
+            chosen.append(n)
+            remaining -= adj[n] | {n}
+        if len(chosen) + len(remaining) < len(best[0]):
+            return
+        if not remaining:
+            chosen.sort(key=index.get)
+            if len(chosen) > len(best[0]) or (
+                    len(chosen) == len(best[0]) and
+                    [index[n] for n in chosen] < [index[n] for n in best[0]]):
+                best[0] = chosen
+            return
+        v = max(remaining, key=lambda n: (len(adj[n] & remaining), -index[n]))
+        search(remaining - adj[v] - {v}, chosen + [v])
+        search(remaining - {v}, chosen)
+
+    search(nodes, [])
+    return best[0]
+
+
+def _greedy_independent(nodes, adj, index):
+    """Returns an independent set of <nodes>, picking low-degree nodes first."""
+    remaining, chosen = set(nodes), []
+    while remaining:
+        n = min(remaining, key=lambda n: (len(adj[n] & remaining), index[n]))
+        chosen.append(n)
+        remaining -= adj[n] | {n}
+    return chosen
+
+
+def plan_merge(mods, gfx=None):
+    """Predicts what merging <mods> would do, without touching the merge
+    folder. See `mods.merge_all_mods`.
+
+    Overlaps are counted against all changes merged before each mod, so the
+    prediction errs towards status 2 where the line merge would interleave
+    adjacent changes instead.
+
+    Args:
+        mods: list of mod names, in merge order.
+        gfx: graphics pack merged first, if any.
+
+    Returns:
+        a list with a dict for each mod, with keys:
+
+            mod: the name of the mod
+            status: predicted merge status (-1 if it would not be merged)
+            cost: estimated work, in lines processed
+            files: list of dicts with keys file, action, status, lines
+                (in the mod file), overlaps (hunks) and cost; action is one
+                of 'replace', 'identical', 'two-way', 'three-way' or
+                'binary copy'
+    """
+    vanilla = baselines.find_vanilla(False)
+    if not vanilla:
+        return [{'mod': m, 'status': -1, 'cost': 0, 'files': []}
+                for m in mods]
+    merged = {}
+    if gfx:
+        raw = os.path.join(vanilla, 'raw')
+        for f, entry in get_footprint('graphics/' + gfx, [
+                (paths.get('graphics', gfx, 'raw'), raw, 'raw')]).items():
+            _plan_file(entry, merged.get(f))
+            merged[f] = _merged_state(entry, None)
+    plan = []
+    for mod in mods:
+        step = {'mod': mod, 'status': 2, 'cost': 0, 'files': []}
+        plan.append(step)
+        if not os.path.isdir(paths.resolve(paths.get('mods', mod), 'raw')):
+            continue
+        for f, entry in sorted(get_footprint(mod).items()):
+            state = merged[f] if f in merged else _start_state(f, entry)
+            action = _plan_file(entry, state)
+            action['file'] = f
+            step['files'].append(action)
+            if action['action'] not in ('identical',):
+                merged[f] = _merged_state(entry, state)
+        step['status'] = max([0] + [a['status'] for a in step['files']])
+        step['cost'] = sum(a['cost'] for a in step['files'])
+    save_cache()
+    return plan
+
+
+def _plan_file(entry, merged):
+    """Predicts the merge action for one file.
+
+    Args:
+        entry: the footprint entry of the file being merged.
+        merged: state of the file from earlier mods (see `_merged_state` and
+            `_start_state`), or None if it is still the vanilla file.
+    """
+    lines = entry.get('lines', 0)
+    result = {'action': 'replace', 'status': 0, 'lines': lines,
+              'overlaps': 0, 'cost': lines}
+    if entry['kind'] == 'binary':
+        current = merged['hash'] if merged else entry['vanilla_hash']
+        if current == entry['hash']:
+            result['action'] = 'identical'
+        else:
+            result['action'] = 'binary copy'
+            result['status'] = 1 if current is None else 2
+        return result
+    if merged is None:
+        return result
+    result['cost'] += merged['lines']
+    if merged.get('missing'):
+        # Three-way merge against the missing file, which only overlaps with
+        # changes to the first vanilla line (see `mods.three_way_merge`)
+        result['action'] = 'three-way'
+        result['cost'] += entry['vanilla_lines']
+        if lines and entry['ranges'] and \
+                entry['ranges'][0][0] == 0 < entry['ranges'][0][1]:
+            result['overlaps'] = 1
+            result['status'] = 2
+        return result
+    if entry['hash'] == merged['hash'] or entry.get('ranges') == []:
+        result['action'] = 'identical'
+    elif entry['kind'] == 'new' or merged['ranges'] is None:
+        result['action'] = 'two-way'
+    else:
+        result['action'] = 'three-way'
+        result['cost'] += entry['vanilla_lines']
+        result['overlaps'] = count_overlaps(merged['ranges'], entry['ranges'])
+        if result['overlaps']:
+            result['status'] = 2
+    return result
+
+
+def _start_state(f, entry):
+    """Returns the state of file <f> in a freshly cleared merge folder: None
+    for the vanilla file, or a 'missing' state where the merge folder leaves
+    the vanilla file out (raw/graphics; see `mods.clear_temp`)."""
+    if not f.startswith('raw/graphics/') or entry['kind'] == 'new':
+        return None
+    return {'hash': None, 'ranges': None, 'lines': 0, 'missing': True}
+
+
+def _merged_state(entry, merged):
+    """Returns the state of a file after merging <entry> into <merged>: a
+    dict of its hash (None if unknown), changed vanilla ranges (None if
+    unknown) and number of lines."""
+    if merged is None or entry['kind'] == 'binary':
+        # Binary files are copied over whatever was there
+        return {'hash': entry['hash'], 'ranges': entry.get('ranges'),
+                'lines': entry.get('lines', 0)}
+    if entry['kind'] != 'text' or merged['ranges'] is None:
+        return {'hash': None, 'ranges': None,
+                'lines': max(merged['lines'], entry.get('lines', 0))}
+    ranges = []
+    for r in sorted(merged['ranges'] + entry['ranges']):
+        if ranges and r[0] <= ranges[-1][1]:
+            ranges[-1] = [ranges[-1][0], max(ranges[-1][1], r[1])]
+        else:
+            ranges.append(list(r))
+    return {'hash': None, 'ranges': ranges,
+            'lines': merged['lines'] + entry['lines'] - entry['vanilla_lines']}
+
+
+def _list_files(folders):
+    """Returns sorted (relative path, path, vanilla path) for mergeable files
+    in <folders>."""
+    result = []
+    for folder, van_folder, prefix in folders:
+        for root, _, files in os.walk(folder):
+            for k in files:
+                if not k.endswith(TEXT_TYPES + BINARY_TYPES):
+                    continue
+                path = os.path.join(root, k)
+                rel = os.path.relpath(path, folder)
+                # Name files after their vanilla counterpart, whatever case
+                # the mod uses
+                van_f = paths.resolve(van_folder, rel)
+                rel = os.path.relpath(van_f, van_folder)
+                result.append((prefix + '/' + rel.replace(os.sep, '/'), path,
+                               van_f))
+    return sorted(result)
+
+
+def _content_key(files, folders):
+    """Returns a key identifying the contents of <files> compared against
+    the baseline in <folders>."""
+    h = hashlib.sha1(_FORMAT)
+    h.update(diff.get_backend().encode('utf-8'))
+    for _, van_folder, _ in folders:
+        h.update(van_folder.encode('utf-8') + b'\0')
+    for rel, path, _ in files:
+        h.update(rel.encode('utf-8') + b'\0')
+        h.update(filesync.hash_file(path).encode('ascii'))
+    return h.hexdigest()
+
+
+def _file_entry(path, van_f):
+    """Returns the footprint entry for one file."""
+    entry = {'hash': filesync.hash_file(path)}
+    if path.endswith(BINARY_TYPES):
+        entry['kind'] = 'binary'
+        entry['vanilla_hash'] = None
+        if os.path.isfile(van_f):
+            entry['vanilla_hash'] = filesync.hash_file(van_f)
+        return entry
+    from . import mods
+    lines = mods.read_lines(path)
+    entry['lines'] = len(lines)
+    if not os.path.isfile(van_f):
+        entry['kind'] = 'new'
+        return entry
+    vanilla = mods.read_lines(van_f)
+    entry['kind'] = 'text'
+    entry['vanilla_lines'] = len(vanilla)
+    entry['ranges'] = [[i1, i2] for tag, i1, i2, _, _ in
+                       diff.get_opcodes(vanilla, lines) if tag != 'equal']
+    return entry
+
+
+def _load_cache():
+    """Loads the footprint cache from disk, once."""
+    # pylint:disable=global-statement
+    global _cache_loaded
+    with _lock:
+        if _cache_loaded:
+            return
+        _cache_loaded = True
+        try:
+            with open(cache_file(), encoding='utf-8') as f:
+                _cache.update(json.load(f))
+        except (IOError, ValueError):
+            log.d('No usable footprint cache at ' + cache_file())
+
+
+def save_cache():
+    """Writes the footprint cache to disk."""
+    with _lock:
+        data = dict(_cache)
+    try:
+        os.makedirs(os.path.dirname(cache_file()), exist_ok=True)
+        with open(cache_file(), 'w', encoding='utf-8') as f:
+            json.dump(data, f)
+    except IOError:
+        log.w('Could not save footprint cache', stack=True)
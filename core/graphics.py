@@ -3,14 +3,24 @@
 """Graphics pack management."""
 
 import glob
+import json
 import os
 import shutil
+from threading import RLock
 
-from . import baselines, colors, df, log, manifest, mods, paths
+from . import baselines, colors, df, filesync, imageinfo, log, manifest, mods, paths
 from .dfraw import DFRaw
 from .launcher import open_file
 from .lnp import lnp
 
+# Pack catalog, as {'folder': graphics folder, 'packs': {pack: entry}}; see
+# `_catalog_entry`
+_catalog = {}
+_catalog_lock = RLock()
+_catalog_dirty = False
+# Tileset index for data/art, and the folder mtimes when tilesets were added
+_tilesets = {}
+
 
 def open_graphics():
     """Opens the graphics pack folder."""
@@ -19,7 +29,7 @@ def open_graphics():
 
 def get_title(pack):
     """Returns the pack title; either per manifest or from dirname."""
-    title = manifest.get_cfg('graphics', pack).get_string('title')
+    title = _catalog_entry(pack)['title']
     if title:
         return title
     return pack
@@ -27,8 +37,7 @@ def get_title(pack):
 
 def get_folder_prefix(pack):
     """Returns the pack folder_prefix; either per manifest or from dirname."""
-    folder_prefix = manifest.get_cfg('graphics', pack).get_string(
-        'folder_prefix')
+    folder_prefix = _catalog_entry(pack)['folder_prefix']
     if folder_prefix:
         return folder_prefix
     return pack
@@ -36,7 +45,7 @@ def get_folder_prefix(pack):
 
 def get_tooltip(pack):
     """Returns the tooltip for the given graphics pack."""
-    return manifest.get_cfg('graphics', pack).get_string('tooltip')
+    return _catalog_entry(pack)['tooltip']
 
 
 def current_pack():
@@ -73,22 +82,121 @@ def logged_graphics(logfile, start='graphics/'):
     return ''
 
 
+def logged_pack(logfile):
+    """Returns the available graphics pack logged in an 'installed_raws.txt'
+    file, or None."""
+    logged = logged_graphics(logfile)
+    packs = [k[0] for k in read_graphics()]
+    # Graphics dirname can change as long as it begins with the folder_prefix.
+    return next((p for p in packs if logged == p or logged.startswith(
+        get_folder_prefix(p))), None)
+
+
 def read_graphics():
-    """Returns a list of tuples of (graphics dir, FONT, GRAPHICS_FONT)."""
-    packs = [os.path.basename(o) for o in
-             glob.glob(paths.get('graphics', '*')) if os.path.isdir(o)
-             and manifest.is_compatible('graphics', os.path.basename(o))]
-    result = []
-    for p in packs:
-        if not validate_pack(p):
-            continue
-        init_path = paths.get('graphics', p, 'data', 'init', 'init.txt')
-        font = DFRaw(init_path).get_value('FONT')
-        graphics = DFRaw(init_path).get_value('GRAPHICS_FONT')
-        result.append((p, font, graphics))
+    """Returns a list of tuples of (graphics dir, FONT, GRAPHICS_FONT).
+
+    Pack details are kept in a catalog, which is saved to disk and only
+    re-read for packs whose folders, init.txt or manifest have changed."""
+    with _catalog_lock:
+        _load_catalog()
+        try:
+            packs = [e.name for e in os.scandir(paths.get('graphics'))
+                     if e.is_dir() and not e.name.startswith('.')]
+        except OSError:
+            packs = []
+        result = []
+        for p in packs:
+            if not validate_pack(p):
+                continue
+            entry = _catalog_entry(p)
+            result.append((p, entry['font'], entry['graphics_font']))
+        for p in set(_catalog['packs']).difference(packs):
+            _forget_pack(p)
+        _save_catalog()
     return tuple(sorted(result))
 
 
+def catalog_file():
+    """Returns the path of the on-disk graphics pack catalog."""
+    return paths.get('baselines', 'cache', 'graphics.json')
+
+
+def _catalog_entry(pack):
+    """Returns the catalog entry for a pack, re-reading the pack if it has
+    changed.
+
+    Entries are dicts with the pack's 'font' and 'graphics_font' from
+    init.txt, the 'title', 'folder_prefix' and 'tooltip' from its manifest,
+    and 'valid', a dict of `validate_pack` results by DF version. 'key' holds
+    the modification times the entry was read at.
+    """
+    # pylint:disable=global-statement
+    global _catalog_dirty
+    gfx_dir = paths.get('graphics', pack)
+    key = [paths.mtime(gfx_dir, *p) for p in (
+        (), ('data',), ('data', 'init'), ('data', 'init', 'init.txt'),
+        ('manifest.json',))]
+    with _catalog_lock:
+        _load_catalog()
+        entry = _catalog['packs'].get(pack)
+        if entry is None or entry['key'] != key:
+            log.d('Reading graphics pack ' + pack)
+            entry = {'key': key, 'font': None, 'graphics_font': None,
+                     'valid': {}}
+            if key[3] is not None:
+                init = DFRaw(os.path.join(gfx_dir, 'data', 'init', 'init.txt'))
+                entry['font'] = init.get_value('FONT')
+                entry['graphics_font'] = init.get_value('GRAPHICS_FONT')
+            cfg = manifest.get_cfg('graphics', pack)
+            for field in ('title', 'folder_prefix', 'tooltip'):
+                entry[field] = cfg.get_string(field)
+            _catalog['packs'][pack] = entry
+            _catalog_dirty = True
+        return entry
+
+
+def _forget_pack(pack):
+    """Removes a pack from the catalog."""
+    # pylint:disable=global-statement
+    global _catalog_dirty
+    with _catalog_lock:
+        if _catalog['packs'].pop(pack, None) is not None:
+            _catalog_dirty = True
+
+
+def _load_catalog():
+    """Loads the catalog from disk when first used, or when the graphics
+    folder has changed."""
+    folder = paths.get('graphics')
+    if _catalog.get('folder') == folder:
+        return
+    _catalog.update(folder=folder, packs={})
+    try:
+        with open(catalog_file(), encoding='utf-8') as f:
+            data = json.load(f)
+        if data.get('folder') == folder:
+            _catalog['packs'] = data['packs']
+    except (IOError, ValueError, KeyError, AttributeError):
+        log.d('No usable graphics catalog at ' + catalog_file())
+
+
+def _save_catalog():
+    """Writes the catalog to disk if it has changed."""
+    # pylint:disable=global-statement
+    global _catalog_dirty
+    with _catalog_lock:
+        if not _catalog_dirty:
+            return
+        _catalog_dirty = False
+        data = json.dumps(_catalog)
+    try:
+        os.makedirs(os.path.dirname(catalog_file()), exist_ok=True)
+        with open(catalog_file(), 'w', encoding='utf-8') as f:
+            f.write(data)
+    except IOError:
+        log.w('Could not save graphics catalog', stack=True)
+
+
 def add_tilesets():
     """Copies missing tilesets from LNP/Tilesets to the data/art folder."""
     for item in glob.glob(paths.get('tilesets', '*')):
@@ -96,7 +204,41 @@ def add_tilesets():
             if os.path.isfile(item):
                 shutil.copy2(item, paths.get('data', 'art'))
             else:
-                shutil.copytree(item, paths.get('data', 'art'))
+                shutil.copytree(item, paths.get(
+                    'data', 'art', os.path.basename(item)))
+
+
+def _art_files(pack):
+    """Returns the files data/art should hold with <pack> installed, as a
+    dict of {relative path: source path}.
+
+    These are the pack's art, plus tilesets from LNP/Tilesets which the pack
+    does not have. TwbT's helper images are kept from the current art, and
+    mouse.png and font.ttf (required by DF) come from the baseline if the
+    pack lacks them.
+    """
+    files = filesync.list_files(paths.get('graphics', pack, 'data', 'art'))
+    names = {f.split('/')[0] for f in files}
+    tilesets = paths.get('tilesets')
+    for item in os.listdir(tilesets) if os.path.isdir(tilesets) else ():
+        path = os.path.join(tilesets, item)
+        if item in names:
+            continue
+        if os.path.isfile(path):
+            files[item] = path
+        else:
+            files.update((item + '/' + k, v) for k, v in
+                         filesync.list_files(path).items())
+    for item in ('white1px.png', 'transparent1px.png'):
+        if os.path.isfile(paths.get('data', 'art', item)):
+            files[item] = paths.get('data', 'art', item)
+    base = baselines.find_vanilla()
+    if base:
+        for item in ('mouse.png', 'font.ttf'):
+            bas = os.path.join(base, 'data', 'art', item)
+            if item not in files and os.path.isfile(bas):
+                files[item] = bas
+    return files
 
 
 def install_graphics(pack):
@@ -118,24 +260,8 @@ def install_graphics(pack):
         # Update raws
         if not update_graphics_raws(paths.get('df', 'raw'), pack):
             return 0
-        # Backup TwbT-specific art files
-        for item in ('white1px.png', 'transparent1px.png'):
-            if os.path.exists(paths.get('data', 'art', item)):
-                shutil.copy(paths.get('data', 'art', item),
-                            paths.get('graphics', pack, 'data', 'art'))
-        # Copy art
-        shutil.rmtree(paths.get('data', 'art'))
-        shutil.copytree(paths.get('graphics', pack, 'data', 'art'),
-                        paths.get('data', 'art'))
-        add_tilesets()
-        # ensure that mouse.png and font.ttf exist (required by DF)
-        base = baselines.find_vanilla()
-        if base:
-            for item in ('mouse.png', 'font.ttf'):
-                cur = paths.get('data', 'art', item)
-                bas = os.path.join(base, 'data', 'art', item)
-                if not os.path.isfile(cur) and os.path.isfile(bas):
-                    shutil.copy2(bas, cur)
+        # Update art, only copying files which differ
+        filesync.sync_files(_art_files(pack), paths.get('data', 'art'))
         # Handle init files
         patch_inits(paths.get('graphics', pack))
 
@@ -191,9 +317,25 @@ def install_graphics(pack):
 
 
 def validate_pack(pack, df_version=None):
-    """Checks for presence of all required files for a pack install."""
+    """Checks for presence of all required files for a pack install.
+    Results are kept in the pack catalog until the pack changes."""
+    # pylint:disable=global-statement
+    global _catalog_dirty
     if df_version is None:
         df_version = lnp.df_info.version
+    version = str(df_version)
+    if 'dfhack' in lnp.df_info.variations:
+        version += '+dfhack'
+    with _catalog_lock:
+        valid = _catalog_entry(pack)['valid']
+        if version not in valid:
+            valid[version] = _validate_pack(pack, df_version)
+            _catalog_dirty = True
+        return valid[version]
+
+
+def _validate_pack(pack, df_version):
+    """Checks the files and manifest of a pack; see `validate_pack`."""
     result = True
     gfx_dir = paths.get('graphics', pack)
     result &= os.path.isdir(gfx_dir)
@@ -288,19 +430,33 @@ def patch_inits(gfx_dir):
 
 
 def simplify_graphics():
-    """Removes unnecessary files from all graphics packs."""
-    for pack in read_graphics():
-        simplify_pack(pack[0])
+    """Removes unnecessary files from all graphics packs.
+
+    Returns:
+        tuple of (number of packs, number of files removed)
+    """
+    results = simplify_packs([pack[0] for pack in read_graphics()])
+    return len(results), sum(r or 0 for r in results.values())
+
+
+def simplify_packs(packs):
+    """Removes unnecessary files from several graphics packs in parallel.
+
+    Returns:
+        dict of {pack: result}; see `simplify_pack`.
+    """
+    return baselines.simplify_packs(packs, 'graphics')
 
 
 def simplify_pack(pack):
-    """Removes unnecessary files from one graphics pack."""
-    a = baselines.simplify_pack(pack, 'graphics')
-    b = baselines.remove_vanilla_raws_from_pack(pack, 'graphics')
-    c = baselines.remove_empty_dirs(pack, 'graphics')
-    if not all(isinstance(n, int) for n in (a, b, c)):
-        return False
-    return a + b + c
+    """Removes unnecessary files from one graphics pack.
+
+    Returns:
+        The number of files removed if successful,
+        ``False`` if an exception occurred,
+        ``None`` if the pack is empty
+    """
+    return simplify_packs([pack])[pack]
 
 
 def savegames_to_update():
@@ -319,6 +475,16 @@ def update_graphics_raws(raw_dir, pack):
     Returns:
         True if successful, False if aborted
     """
+    result = _update_raw_dirs([raw_dir], pack)
+    return result if result is None else bool(result)
+
+
+def _update_raw_dirs(raw_dirs, pack, progress=None):
+    """Updates raw dirs built from the same mods to a new graphics pack.
+
+    Returns:
+        a list of the dirs updated, or None if the pack cannot be used
+    """
     if not validate_pack(pack):
         log.w('Cannot update raws to an invalid graphics pack (' + pack + ')')
         return None
@@ -328,23 +494,56 @@ def update_graphics_raws(raw_dir, pack):
         log.w('Save raws not compatible with ' + pack + ' graphics, aborting.')
         return None
     built_graphics = logged_graphics(built_log)
-    if mods.update_raw_dir(raw_dir, gfx=(pack, built_graphics)):
-        log.i('Safely updated graphics raws ' + raw_dir + ' to ' + pack)
-        return True
-    log.i('Aborted while updating raws ' + raw_dir + ' to ' + pack)
-    return False
+    done = mods.update_raw_dirs(
+        raw_dirs, gfx=(pack, built_graphics), progress=progress)
+    for raw_dir in raw_dirs:
+        if raw_dir in done:
+            log.i('Safely updated graphics raws ' + raw_dir + ' to ' + pack)
+        else:
+            log.i('Aborted while updating raws ' + raw_dir + ' to ' + pack)
+    return done
 
 
-def update_savegames():
-    """Update save games with current raws."""
-    count, skipped, saves = 0, 0, savegames_to_update()
-    for save_raws in [paths.get('saves', s, 'raw') for s in saves]:
-        r = can_rebuild(os.path.join(save_raws, 'installed_raws.txt'))
-        if r and update_graphics_raws(save_raws, current_pack()):
-            count += 1
-        else:
-            skipped += 1
-    return count, skipped
+def update_savegames(progress=None):
+    """Update save games with current raws.
+
+    Saves are grouped by the mods and graphics pack in their
+    installed_raws.txt, so each combination is merged once; the merged raws
+    are then copied to the saves in parallel.
+
+    Args:
+        progress: if given, called as ``progress(done, total, save)`` after
+            each save is updated or skipped, possibly from another thread.
+
+    Returns:
+        tuple of (number of saves updated, number skipped)
+    """
+    saves = savegames_to_update()
+    groups = {}
+    for save in saves:
+        log_file = os.path.join(save, 'raw', 'installed_raws.txt')
+        key = os.path.isfile(log_file) and (
+            tuple(mods.read_installation_log(log_file)),
+            logged_graphics(log_file))
+        groups.setdefault(key, []).append(os.path.join(save, 'raw'))
+    finished, lock = [], RLock()
+
+    def report(raw_dir, _=None):
+        """Passes progress for one save on to <progress>."""
+        with lock:
+            finished.append(raw_dir)
+            if progress:
+                progress(len(finished), len(saves), os.path.dirname(raw_dir))
+
+    pack = current_pack() if saves else None
+    count = 0
+    for raw_dirs in groups.values():
+        if can_rebuild(os.path.join(raw_dirs[0], 'installed_raws.txt')):
+            count += len(_update_raw_dirs(raw_dirs, pack, report) or ())
+        for raw_dir in raw_dirs:
+            if raw_dir not in finished:
+                report(raw_dir)
+    return count, len(saves) - count
 
 
 def can_rebuild(log_file, strict=True):
@@ -352,10 +551,7 @@ def can_rebuild(log_file, strict=True):
     if not os.path.isfile(log_file):
         log.w('Cannot change graphics without log: {}'.format(log_file))
         return not strict
-    # Graphics dirname can change as long as it begins with the folder_prefix.
-    names = [(pack, get_folder_prefix(pack))
-             for pack in [k[0] for k in read_graphics()]]
-    graphic_ok = any(logged_graphics(log_file) in n for n in names)
+    graphic_ok = logged_pack(log_file) is not None
     if graphic_ok and mods.can_rebuild(log_file, strict=strict):
         return True
     log.i('Components unavailable to rebuild raws in '
@@ -370,29 +566,53 @@ def open_tilesets():
 
 def read_tilesets():
     """Returns a tuple of available tileset files. Also copies missing tilesets
-    from LNP/Tilesets to data/art."""
-    add_tilesets()
-    files = glob.glob(paths.get('data', 'art', '*.bmp'))
+    from LNP/Tilesets to data/art, if either folder has changed."""
+    key = [paths.mtime(paths.get('tilesets')),
+           paths.mtime(paths.get('data', 'art'))]
+    if _tilesets.get('added') != key:
+        add_tilesets()
+        key[1] = paths.mtime(paths.get('data', 'art'))
+        _tilesets['added'] = key
+    extensions = ('.bmp',)
     if 'legacy' not in lnp.df_info.variations:
-        files += glob.glob(paths.get('data', 'art', '*.png'))
-    files = sorted(
-        o for o in [os.path.basename(f) for f in files] if not any(
-            o.startswith(a) for a in [
-                'transparent1px.png', 'white1px.png', 'shadows.png', 'mouse.',
-                '_']))
-
-    i = 0
-    while i < len(files):  # Manual loop to allow modification during iteration
-        filename = os.path.splitext(files[i])
-        bgname = filename[0] + '-bg.png'
-        topname = filename[0] + '-top.png'
-        if bgname in files and topname in files:
-            files.remove(bgname)
-            files.remove(topname)
+        extensions += ('.png',)
+    files = {f for f in tileset_index() if f.lower().endswith(extensions)
+             and not f.startswith(('transparent1px.png', 'white1px.png',
+                                   'shadows.png', 'mouse.', '_'))}
+    # Hide -bg and -top variants of a tileset, if both are present
+    hidden = set()
+    for f in files:
+        stem = os.path.splitext(f)[0]
+        variants = {stem + '-bg.png', stem + '-top.png'}
+        if variants <= files:
+            hidden.update(variants)
+    return tuple(sorted(files - hidden))
+
+
+def tileset_index():
+    """Returns a dict of {file name: ImageInfo} for the images in data/art.
+
+    Only image headers are read, and only for files whose size or
+    modification time has changed since the last call.
+    """
+    art = paths.get('data', 'art')
+    if _tilesets.get('folder') != art:
+        _tilesets.update(folder=art, files={})
+    old, files = _tilesets['files'], {}
+    try:
+        entries = [e for e in os.scandir(art) if e.is_file()
+                   and e.name.lower().endswith(('.bmp', '.png'))]
+    except OSError:
+        entries = []
+    for e in entries:
+        st = e.stat()
+        key = (st.st_size, st.st_mtime_ns)
+        if e.name in old and old[e.name][0] == key:
+            files[e.name] = old[e.name]
         else:
-            i = i + 1
-
-    return tuple(files)
+            files[e.name] = (key, imageinfo.read_info(e.path))
+    _tilesets['files'] = files
+    return {k: v[1] for k, v in files.items() if v[1]}
 
 
 def current_tilesets():
@@ -0,0 +1,56 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Reads image dimensions from BMP and PNG headers, without decoding pixels."""
+
+import struct
+from collections import namedtuple
+
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+
+# Channels per pixel for each PNG colour type
+_PNG_CHANNELS = {0: 1, 2: 3, 3: 1, 4: 2, 6: 4}
+
+
+class ImageInfo(namedtuple('ImageInfo', ['format', 'width', 'height', 'bits'])):
+    """Basic facts about an image file.
+
+    Attributes:
+        format: 'bmp' or 'png'
+        width, height: size in pixels
+        bits: bits per pixel
+    """
+    __slots__ = ()
+
+    @property
+    def tile_size(self):
+        """The (width, height) of one tile if the image is a 16x16 grid of
+        tiles, as DF tilesets are, or None."""
+        if self.width and self.height and not (
+                self.width % 16 or self.height % 16):
+            return self.width // 16, self.height // 16
+        return None
+
+
+def read_info(path):
+    """Returns an ImageInfo for the BMP or PNG file at <path>, or None if the
+    file is missing or not a supported image."""
+    try:
+        with open(path, 'rb') as f:
+            header = f.read(32)
+    except IOError:
+        return None
+    try:
+        if header.startswith(PNG_SIGNATURE) and header[12:16] == b'IHDR':
+            width, height, depth, colour = struct.unpack('>IIBB', header[16:26])
+            return ImageInfo('png', width, height,
+                             depth * _PNG_CHANNELS.get(colour, 1))
+        if header.startswith(b'BM'):
+            if struct.unpack('<I', header[14:18])[0] == 12:
+                # OS/2 bitmaps have 16-bit sizes
+                width, height, _, bits = struct.unpack('<HHHH', header[18:26])
+            else:
+                width, height, _, bits = struct.unpack('<iiHH', header[18:30])
+            return ImageInfo('bmp', width, abs(height), bits)
+    except struct.error:
+        pass
+    return None
@@ -110,6 +110,10 @@ class PyLNP(object):
 
         self.initialize_df()
 
+        from . import batch
+        if batch.is_requested(self.args):
+            sys.exit(batch.run(self.args))
+
         self.new_version = None
 
         self.initialize_ui()
@@ -180,6 +184,9 @@ class PyLNP(object):
         }
         self.config = JSONConfiguration(config_file, default_config)
         self.userconfig = JSONConfiguration('PyLNP.user')
+        if self.userconfig.get_string('diff_backend'):
+            from . import diff
+            diff.set_backend(self.userconfig.get_string('diff_backend'))
         self.autorun = []
         utilities.load_autorun()
 
@@ -247,6 +254,30 @@ class PyLNP(object):
         parser.add_argument(
             '--df-executable', action='store',
             help='Override DF/DFHack executable name')
+        parser.add_argument(
+            '--merge-mods', metavar='MOD,...',
+            help='Merge a comma-separated list of mods without starting the '
+            'UI, printing the results as JSON')
+        parser.add_argument(
+            '--gfx', metavar='PACK',
+            help='Graphics pack to merge mods on top of (with --merge-mods)')
+        parser.add_argument(
+            '--install', action='store_true',
+            help='Install the merged mods (with --merge-mods)')
+        parser.add_argument(
+            '--update-saves', action='store_true',
+            help='Update save games after installing (with --merge-mods)')
+        parser.add_argument(
+            '--rebase-mods', nargs=2, metavar=('OLD', 'NEW'),
+            help='Update all mods from one DF baseline to another (eg '
+            'df_47_04 df_47_05) without starting the UI')
+        parser.add_argument(
+            '--simplify', action='store_true',
+            help='Simplify all mods and graphics packs without starting the '
+            'UI')
+        parser.add_argument(
+            '--install-graphics', metavar='PACK',
+            help='Install a graphics pack without starting the UI')
         parser.add_argument(
             '--release-prep', action='store_true',
             help=argparse.SUPPRESS)
@@ -3,13 +3,16 @@
 """Mod Pack management and merging tools."""
 
 import glob
+import json
 import os
 import shutil
 import sys
 import time
-from difflib import SequenceMatcher, ndiff
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from difflib import ndiff
 
-from . import baselines, log, manifest, paths
+from . import baselines, dfraw, diff, filesync, footprints, log, manifest, paths
 from .lnp import lnp
 
 
@@ -33,6 +36,38 @@ if sys.platform == 'win32':
     shutil.copytree = _shutil_wrap(shutil.copytree)
 
 
+# Sidecar to installed_raws.txt, with hashes of the merge inputs and outputs
+MANIFEST = 'installed_raws.json'
+
+# Overlapping changes from the last merge, as {mod: [Conflict, ...]}
+_conflicts = {}
+# Files and dirs changed by the mod being merged, used to undo a failed merge
+_checkpoint = None
+# Baseline and changed paths for the merge folder, if built by clear_temp
+_workspace = None
+
+
+class Conflict(namedtuple(
+        'Conflict', ['file', 'vanilla_range', 'gen_lines', 'mod_lines'])):
+    """An overlap found while merging a mod.
+
+    Attributes:
+        file: path of the generated file
+        vanilla_range: (start, end) line numbers in the vanilla file
+        gen_lines: the previously merged lines for the overlapping change
+        mod_lines: the mod's lines for the overlapping change
+    """
+    __slots__ = ()
+
+
+def get_conflicts(mod=None):
+    """Returns the overlapping changes found by the last merge, either for
+    one mod or as a dict of {mod: [Conflict, ...]}."""
+    if mod is not None:
+        return list(_conflicts.get(mod, []))
+    return {m: list(c) for m, c in _conflicts.items()}
+
+
 def toggle_premerge_gfx():
     """Sets the option for pre-merging of graphics."""
     lnp.userconfig['premerge_graphics'] = not lnp.userconfig.get_bool(
@@ -45,6 +80,32 @@ def will_premerge_gfx():
     return lnp.userconfig.get_bool('premerge_graphics')
 
 
+def toggle_object_merge():
+    """Sets the option for merging object raws one object at a time."""
+    lnp.userconfig['merge_objects'] = not lnp.userconfig.get_bool(
+        'merge_objects')
+    lnp.userconfig.save_data()
+
+
+def will_merge_objects():
+    """Returns whether object raws are merged by object instead of by line."""
+    return lnp.userconfig.get_bool('merge_objects')
+
+
+def toggle_patience_diff():
+    """Switches the diff backend used for merging between difflib and
+    patience diff (see `diff.patience_opcodes`)."""
+    lnp.userconfig['diff_backend'] = (
+        'difflib' if will_use_patience_diff() else 'patience')
+    lnp.userconfig.save_data()
+    diff.set_backend(lnp.userconfig['diff_backend'])
+
+
+def will_use_patience_diff():
+    """Returns whether merging diffs raws with patience diff."""
+    return diff.get_backend() == 'patience'
+
+
 def read_mods():
     """Returns a list of mod packs"""
     return [os.path.basename(o) for o in glob.glob(paths.get('mods', '*'))
@@ -66,12 +127,13 @@ def get_tooltip(mod):
 
 
 def simplify_mods():
-    """Removes unnecessary files from all mods."""
-    mods, files = 0, 0
-    for pack in read_mods():
-        mods += 1
-        files += simplify_pack(pack)
-    return mods, files
+    """Removes unnecessary files from all mods.
+
+    Returns:
+        tuple of (number of mods, number of files affected)
+    """
+    results = baselines.simplify_packs(read_mods(), 'mods')
+    return len(results), sum(r or 0 for r in results.values())
 
 
 def simplify_pack(pack):
@@ -84,61 +146,29 @@ def simplify_pack(pack):
     Returns:
         The sum of files affected by the operations
     """
-    # Here we use the heuristic that mods which are bundled with other files
-    # contain a complete set of raws, and vanilla files which are missing
-    # should not be inserted.  We thus add empty files to fill out the set in
-    # cases where several files are removed.
-    i = baselines.simplify_pack(pack, 'mods')
-    if not i:
-        i = 0
-    if i > 10:
-        log.w('Reducing mod "{}": assume vanilla files were omitted '
-              'deliberately'.format(pack))
-        i += make_blank_files(pack)
-    i += baselines.remove_vanilla_raws_from_pack(pack, 'mods')
-    i += baselines.remove_empty_dirs(pack, 'mods')
-    return i
-
+    return baselines.simplify_packs([pack], 'mods')[pack] or 0
 
-def make_blank_files(pack):
-    """Create blank files where vanilla files are missing.
 
-    Params:
-        pack
-            path segment in './LNP/folder/pack/' as strings
+def install_mods():
+    """Replaces the installed raw and speech folders with the merged ones,
+    copying only changed files.
 
     Returns:
-        The number of blank files created
+        a filesync.SyncReport of the files written, or False if aborted.
     """
-    i = 0
-    vanilla_raws = baselines.find_vanilla_raws()
-    for root, _, files in os.walk(vanilla_raws):
-        for k in files:
-            f = os.path.relpath(os.path.join(root, k), vanilla_raws)
-            if not os.path.isfile(paths.get('mods', pack, f)):
-                filepath = paths.get('mods', pack, f)
-                with open(filepath, 'w', encoding="utf-8") as blank:
-                    blank.write('')
-                    i += 1
-    return i
-
-
-def install_mods():
-    """Deletes installed raw folder, and copies over merged raws."""
     merge_log = paths.get('baselines', 'temp', 'raw', 'installed_raws.txt')
     if read_installation_log(merge_log):
-        shutil.rmtree(paths.get('df', 'raw'))
-        shutil.rmtree(paths.get('df', 'data', 'speech'))
-        shutil.copytree(paths.get('baselines', 'temp', 'raw'),
-                        paths.get('df', 'raw'))
-        shutil.copytree(paths.get('baselines', 'temp', 'data', 'speech'),
-                        paths.get('df', 'data', 'speech'))
-        return True
+        report = filesync.sync_tree(paths.get('baselines', 'temp', 'raw'),
+                                    paths.get('df', 'raw'))
+        report += filesync.sync_tree(
+            paths.get('baselines', 'temp', 'data', 'speech'),
+            paths.get('df', 'data', 'speech'))
+        return report
     log.w('To avoid data loss, PyLNP only installs mods if a log exists')
     return False
 
 
-def merge_all_mods(list_of_mods, gfx=None):
+def merge_all_mods(list_of_mods, gfx=None, dry_run=False):
     """Merges the specified list of mods, starting with graphics if set to
     pre-merge (or if a pack is specified explicitly).
 
@@ -147,6 +177,10 @@ def merge_all_mods(list_of_mods, gfx=None):
             a list of the names of mods to merge
         gfx
             a graphics pack to be merged in
+        dry_run
+            if True, nothing is merged; instead a plan of the actions, status
+            and cost predicted for each mod and file is returned (see
+            `footprints.plan_merge`)
 
     Returns:
         A list of status ints for each mod given:
@@ -154,88 +188,198 @@ def merge_all_mods(list_of_mods, gfx=None):
             0:  Merge was successful, all well
             1:  Potential compatibility issues, no merge problems
             2:  Non-fatal error, overlapping lines or non-existent mod etc.
-            3:  Fatal error, not returned (rebuilds to previous, rest unmerged)
+            3:  Fatal error, not returned (that mod's changes are undone,
+                and it and the rest are reported as unmerged)
+
+    Overlapping changes found while merging are available from
+    `get_conflicts` afterwards.
     """
     from . import graphics
+    if not gfx and will_premerge_gfx():
+        gfx = graphics.current_pack()
+    if dry_run:
+        return footprints.plan_merge(list_of_mods, gfx)
+    vanilla = baselines.find_vanilla()
+    if not vanilla:
+        log.e('Could not merge: baseline raws unavailable')
+        return [-1] * len(list_of_mods)
     clear_temp()
+    _conflicts.clear()
     if gfx:
         add_graphics(gfx)
-    elif will_premerge_gfx():
-        add_graphics(graphics.current_pack())
     ret_list = []
     for i, mod in enumerate(list_of_mods):
-        status = merge_a_mod(mod)
-        ret_list.append(status)
+        _start_checkpoint()
+        status = merge_a_mod(mod, vanilla)
         if status == 3:
             log.i('Mod {}, in {}, could not be merged.'.format(
                 mod, str(list_of_mods)))
-            merged = merge_all_mods(list_of_mods[:i - 1], gfx)
-            return merged + [-1] * len(list_of_mods[i:])
+            _rollback_checkpoint()
+            _conflicts.pop(mod, None)
+            write_manifest(paths.get('baselines', 'temp', 'raw'), gfx)
+            return ret_list + [-1] * len(list_of_mods[i:])
+        _end_checkpoint()
+        ret_list.append(status)
+    write_manifest(paths.get('baselines', 'temp', 'raw'), gfx)
     return ret_list
 
 
-def merge_a_mod(mod):
+def _start_checkpoint():
+    """Starts recording changes to the merge folder, so that the next mod can
+    be undone without rebuilding everything merged before it."""
+    # pylint:disable=global-statement
+    global _checkpoint
+    _checkpoint = {'files': {}, 'dirs': []}
+
+
+def _end_checkpoint():
+    """Stops recording changes to the merge folder."""
+    # pylint:disable=global-statement
+    global _checkpoint
+    _checkpoint = None
+
+
+def _rollback_checkpoint():
+    """Restores every file and directory changed since the last call to
+    `_start_checkpoint`."""
+    if _checkpoint is None:
+        return
+    for path, contents in _checkpoint['files'].items():
+        try:
+            if contents is None:
+                if os.path.isfile(path):
+                    os.remove(path)
+            else:
+                with open(path, 'wb') as f:
+                    f.write(contents)
+        except OSError:
+            log.e('Could not restore ' + path, stack=True)
+    for path in reversed(_checkpoint['dirs']):
+        try:
+            os.rmdir(path)
+        except OSError:
+            pass
+    _end_checkpoint()
+
+
+def _before_write(path, overwrite=True):
+    """Called before a file in the merge folder is written.
+
+    Records its contents if a checkpoint is active, marks it as changed in the
+    merge workspace, and makes sure the file no longer shares its data with
+    the baseline. If <overwrite> is False, the existing contents are kept in
+    the private copy (eg for appending); otherwise the link is just removed.
+    """
+    if _checkpoint is not None and path not in _checkpoint['files']:
+        try:
+            with open(path, 'rb') as f:
+                _checkpoint['files'][path] = f.read()
+        except IOError:
+            _checkpoint['files'][path] = None
+    if _workspace is not None and os.path.abspath(path).startswith(
+            _workspace['root'] + os.sep):
+        _workspace['dirty'].add(path)
+    try:
+        if os.stat(path).st_nlink < 2:
+            return
+    except OSError:
+        return
+    if overwrite:
+        os.remove(path)
+    else:
+        shutil.copy2(path, path + '.tmp')
+        os.replace(path + '.tmp', path)
+
+
+def _makedirs(path):
+    """Creates <path> and any missing parents, recording them if a checkpoint
+    is active."""
+    missing = []
+    while path and not os.path.isdir(path):
+        missing.append(path)
+        path = os.path.dirname(path)
+    for d in reversed(missing):
+        os.mkdir(d)
+        if _checkpoint is not None:
+            _checkpoint['dirs'].append(d)
+        if _workspace is not None:
+            _workspace['dirs'].append(d)
+
+
+def merge_a_mod(mod, vanilla=None):
     """Merges the specified mod, and returns an exit code 0-3.
 
         0:  Merge was successful, all well
         1:  Potential compatibility issues, no merge problems
         2:  Non-fatal error, overlapping lines or non-existent mod etc.
         3:  Fatal error, respond by rebuilding to previous mod
+
+    <vanilla> is the baseline folder, if already known.
         """
     log.push_prefix('In "' + mod + '": ')
-    if not baselines.find_vanilla_raws():
+    if vanilla is None:
+        vanilla = baselines.find_vanilla()
+    if not vanilla:
         log.e('Could not merge: baseline raws unavailable')
+        log.pop_prefix()
         return 3
     log.d('Starting to merge mod: {}'.format(mod))
-    mod_raw_folder = paths.get('mods', mod, 'raw')
+    mod_raw_folder = paths.resolve(paths.get('mods', mod), 'raw')
+    mod_speech_folder = paths.resolve(paths.get('mods', mod), 'data/speech')
     if not os.path.isdir(mod_raw_folder):
         log.w('mod is invalid; /raw/ must be a directory')
+        log.pop_prefix()
         return 2
-    status = merge_folder(mod_raw_folder, baselines.find_vanilla_raws(),
-                          paths.get('baselines', 'temp', 'raw'))
-    if os.path.isdir(paths.get('mods', mod, 'data', 'speech')):
+    conflicts = _conflicts.setdefault(mod, [])
+    status = merge_folder(mod_raw_folder, os.path.join(vanilla, 'raw'),
+                          paths.get('baselines', 'temp', 'raw'), conflicts)
+    if os.path.isdir(mod_speech_folder):
         status = max(status, merge_folder(
-            paths.get('mods', mod, 'data', 'speech'),
-            os.path.join(baselines.find_vanilla(), 'data', 'speech'),
-            paths.get('baselines', 'temp', 'data', 'speech')))
+            mod_speech_folder, os.path.join(vanilla, 'data', 'speech'),
+            paths.get('baselines', 'temp', 'data', 'speech'), conflicts))
     if status < 3:
-        with open(paths.get('baselines', 'temp', 'raw', 'installed_raws.txt'),
-                  'a', encoding="utf-8") as f:
+        merge_log = paths.get('baselines', 'temp', 'raw', 'installed_raws.txt')
+        _before_write(merge_log, overwrite=False)
+        with open(merge_log, 'a', encoding="utf-8") as f:
             f.write('mods/' + mod + '\n')
     log.i('Finished merging')
     log.pop_prefix()
     return status
 
 
-def merge_folder(mod_folder, vanilla_folder, mixed_folder):
+def merge_folder(mod_folder, vanilla_folder, mixed_folder, conflicts=None):
     """Merge the specified folders, output going in 'LNP/Baselines/temp'
-    Text files are merged; other files (sprites etc.) are copied over."""
+    Text files are merged; other files (sprites etc.) are copied over.
+    Overlapping changes are appended to <conflicts>, if given."""
     status = 0
     for root, _, files in os.walk(mod_folder):
 
         # We want to make any directory in our mod folder in the mixed folder
         # if it doesn't already exist. Fixes #173
-        mixed_dir = os.path.join(mixed_folder,
-                                 os.path.relpath(root, mod_folder))
+        mixed_dir = paths.resolve(mixed_folder,
+                                  os.path.relpath(root, mod_folder))
 
         if not os.path.isdir(mixed_dir):
-            os.makedirs(mixed_dir)
+            _makedirs(mixed_dir)
 
         for k in files:
             f = os.path.relpath(os.path.join(root, k), mod_folder)
             log.push_prefix('file "' + f + '": ')
             log.d('merging...')
             mod_f = os.path.join(mod_folder, f)
-            van_f = os.path.join(vanilla_folder, f)
-            gen_f = os.path.join(mixed_folder, f)
+            # Mods made on Windows may not match the case of vanilla files
+            van_f = paths.resolve(vanilla_folder, f)
+            gen_f = paths.resolve(mixed_folder, f)
             if any(f.endswith(a) for a in ('.txt', '.init')):
                 # merge raws and DFHack init files
-                status = max(status, merge_file(mod_f, van_f, gen_f))
+                status = max(status, merge_file(mod_f, van_f, gen_f,
+                                                conflicts))
             elif any(f.endswith(a) for a in ('.lua', '.rb', '.bmp', '.png')):
                 # copy DFHack scripts or sprite sheets
                 if not os.path.isdir(os.path.dirname(gen_f)):
-                    os.makedirs(os.path.dirname(gen_f))
+                    _makedirs(os.path.dirname(gen_f))
                 if not os.path.isfile(gen_f):
+                    _before_write(gen_f)
                     shutil.copy2(mod_f, gen_f)
                     status = max(1, status)
                 else:
@@ -244,6 +388,7 @@ def merge_folder(mod_folder, vanilla_folder, mixed_folder):
                     with open(gen_f, 'rb') as f:
                         gb = f.read()
                     if mb != gb:
+                        _before_write(gen_f)
                         shutil.copyfile(mod_f, gen_f)
                         status = max(2, status)
             log.d('merged with status {}'.format(status))
@@ -251,25 +396,28 @@ def merge_folder(mod_folder, vanilla_folder, mixed_folder):
     return status
 
 
-def merge_file(mod_file_name, van_file_name, gen_file_name):
+def merge_file(mod_file_name, van_file_name, gen_file_name, conflicts=None):
     """Merges three files, and returns an exit code 0-3.
 
         0:  Merge was successful, all well
         1:  Potential compatibility issues, no merge problems
         2:  Non-fatal error, overlapping lines or non-existent mod etc.
         3:  Fatal error, respond by rebuilding to previous mod
+
+    Overlapping changes are appended to <conflicts>, if given.
     """
     van_lines, mod_lines, gen_lines = [], [], []
     for fname, lines in ((van_file_name, van_lines),
                          (mod_file_name, mod_lines),
                          (gen_file_name, gen_lines)):
         try:
-            with open(fname, encoding='cp437', errors='replace') as f:
-                lines.extend(f.readlines())
+            lines.extend(read_lines(fname))
         except IOError:
             log.d(fname + ' cannot be read; merging other files')
-    status, gen_lines = merge_line_list(mod_lines, van_lines, gen_lines)
+    status, gen_lines = merge_line_list(
+        mod_lines, van_lines, gen_lines, conflicts, gen_file_name)
     try:
+        _before_write(gen_file_name)
         with open(gen_file_name, "w", encoding='cp437') as gen_file:
             gen_file.writelines(gen_lines)
     except Exception:
@@ -278,7 +426,8 @@ def merge_file(mod_file_name, van_file_name, gen_file_name):
     return status
 
 
-def merge_line_list(mod_text, vanilla_text, gen_text):
+def merge_line_list(mod_text, vanilla_text, gen_text, conflicts=None,
+                    filename='', by_object=None):
     """Merges sequences of lines.
 
     Params:
@@ -288,10 +437,18 @@ def merge_line_list(mod_text, vanilla_text, gen_text):
             The lines of the corresponding vanilla file.
         gen_text
             The lines of the previously merged file or files.
+        conflicts
+            If given, a list which overlapping changes are appended to.
+        filename
+            The file name recorded in conflicts.
+        by_object
+            Whether to try merging object by object (see `merge_objects`);
+            defaults to the user's setting.
 
     Returns:
         tuple(status, lines); status is 0/'ok' or 2/'overlap merged'
     """
+    # pylint:disable=too-many-arguments,too-many-positional-arguments
     if mod_text and vanilla_text == gen_text:
         log.d('no overlap with previous mods, replacing vanilla file')
         return 0, mod_text
@@ -304,103 +461,221 @@ def merge_line_list(mod_text, vanilla_text, gen_text):
     if mod_text and gen_text and not vanilla_text:
         log.d('Falling back to two-way merge; no vanilla file exists.')
         return 0, [s[2:] for s in ndiff(gen_text, mod_text)]
+    if by_object is None:
+        by_object = will_merge_objects()
+    if by_object:
+        result = merge_objects(
+            mod_text, vanilla_text, gen_text, conflicts, filename)
+        if result is not None:
+            return result
     log.d('performing three-way merge')
-    # SequenceMatcher describes the diff to vanilla
-    gen_ops = SequenceMatcher(None, vanilla_text, gen_text).get_opcodes()
-    mod_ops = SequenceMatcher(None, vanilla_text, mod_text).get_opcodes()
+    # opcodes describe the diff to vanilla
+    gen_ops = diff.get_opcodes(vanilla_text, gen_text)
+    mod_ops = diff.get_opcodes(vanilla_text, mod_text)
     outfile = []
-    for block in three_way_merge(gen_text, gen_ops, mod_text, mod_ops):
-        log.d('writing block')
+    for block in three_way_merge(gen_text, gen_ops, mod_text, mod_ops,
+                                 conflicts, filename):
         outfile.extend(block)
     status = outfile.pop()
     return status, outfile
 
 
-def three_way_merge(gen_text, van_gen_ops, mod_text, van_mod_ops):
-    """Yield blocks of lines from a three-way-merge.  Last block is status."""
-    # pylint:disable=too-many-statements
+def merge_objects(mod_text, vanilla_text, gen_text, conflicts=None,
+                  filename=''):
+    """Merges the lines of object raw files one top-level object at a time.
+
+    Objects which only one side changed are taken as a whole, and a line-level
+    three-way merge is only run inside objects changed by both sides.  Objects
+    added by the mod are placed after the object preceding them in the mod.
+
+    Returns:
+        tuple(status, lines) as for `merge_line_list`, or None if any of the
+        files could not be split into objects.
+    """
+    # pylint:disable=too-many-arguments,too-many-positional-arguments
+    # pylint:disable=too-many-locals
+    split = [dfraw.split_objects(t) for t in (vanilla_text, gen_text, mod_text)]
+    if None in split:
+        return None
+    log.d('performing object-level merge')
+    van, gen, mod = (dict((k, tuple(v)) for k, v in s) for s in split)
+    van_start, line = {}, 0
+    for key, lines in split[0]:
+        van_start[key] = line
+        line += len(lines)
+    # Objects new to the merge go after the object before them in the mod
+    added, prev = {}, ''
+    for key, _ in split[2]:
+        if key in gen:
+            prev = key
+        else:
+            added.setdefault(prev, []).append(key)
+    status, outfile = 0, []
+    for gen_key, _ in split[1]:
+        for key in [gen_key] + added.get(gen_key, []):
+            s, chunk = _merge_object(
+                van.get(key), gen.get(key), mod.get(key), conflicts, filename,
+                van_start.get(key, 0))
+            status = max(status, s)
+            if chunk:
+                outfile.extend(chunk)
+    return status, outfile
+
+
+def _merge_object(v, g, m, conflicts, filename, start):
+    """Merges the vanilla, generated and mod lines of one object, any of which
+    may be None if the object is missing. Returns tuple(status, lines)."""
+    # pylint:disable=too-many-arguments,too-many-positional-arguments
+    if m in (g, v):
+        return 0, g
+    if g == v:
+        return 0, m
+    if g is None or m is None or v is None:
+        # Changed on one side, removed or added separately on the other
+        if conflicts is not None:
+            conflicts.append(Conflict(
+                filename, (start, start + len(v or ())), list(g or ()),
+                list(m or ())))
+        return 2, m if m is not None else g
+    found = []
+    status, lines = merge_line_list(
+        list(m), list(v), list(g), found, filename, False)
+    if conflicts is not None:
+        conflicts.extend(c._replace(vanilla_range=(
+            c.vanilla_range[0] + start, c.vanilla_range[1] + start))
+                         for c in found)
+    return status, lines
+
+
+def three_way_merge(gen_text, van_gen_ops, mod_text, van_mod_ops,
+                    conflicts=None, filename=''):
+    """Yield blocks of lines from a three-way-merge.  Last block is status.
+
+    The opcode lists are walked with index cursors and are not modified.
+    If a list is given as <conflicts>, a `Conflict` is appended to it for
+    each overlapping change, with <filename> as the file.
+    """
+    # pylint:disable=too-many-arguments,too-many-positional-arguments
+    # pylint:disable=too-many-locals
     status, cur_v, mod_i2, gen_i2 = 0, 0, 1, 1
-    while van_mod_ops and van_gen_ops:
-        log.d('before pop')
-        log.d('gen ops: ' + str(van_gen_ops))
-        log.d('mod ops: ' + str(van_mod_ops))
-        log.d(
-            'mod_i2: ' + str(mod_i2)
-            + ' gen_i2: ' + str(gen_i2)
-            + ' cur_v: ' + str(cur_v))
+    mod_n, gen_n = 0, 0
+    while mod_n < len(van_mod_ops) and gen_n < len(van_gen_ops):
         if mod_i2 <= cur_v:
-            log.d('pop mod')
-            van_mod_ops.pop(0)
+            mod_n += 1
         if gen_i2 <= cur_v:
-            log.d('pop gen')
-            van_gen_ops.pop(0)
-        log.d('after pop')
-        log.d('gen ops: ' + str(van_gen_ops))
-        log.d('mod ops: ' + str(van_mod_ops))
-        if len(van_mod_ops) == 0 or len(van_gen_ops) == 0:
-            log.d('out of entries')
+            gen_n += 1
+        if mod_n == len(van_mod_ops) or gen_n == len(van_gen_ops):
             break
-        _, _, mod_i2, mod_j1, mod_j2 = van_mod_ops[0]
-        gen_tag, _, gen_i2, gen_j1, gen_j2 = van_gen_ops[0]
+        mod_tag, _, mod_i2, mod_j1, mod_j2 = van_mod_ops[mod_n]
+        gen_tag, gen_i1, gen_i2, gen_j1, gen_j2 = van_gen_ops[gen_n]
         low_i2 = min(mod_i2, gen_i2)
-        if van_mod_ops[0][0] == 'equal':
-            log.d('equal mod ops')
+        if mod_tag == 'equal':
             if gen_tag == 'equal':
-                log.d('equal gen tag')
-                yield gen_text[cur_v:low_i2]
+                # Vanilla lines, at their position in the merged file
+                shift = gen_j1 - gen_i1
+                yield gen_text[cur_v + shift:low_i2 + shift]
                 cur_v = low_i2
-                log.d('back from equal gen tag')
                 continue
-            log.d('not equal gen tag')
             yield gen_text[gen_j1:gen_j2]
             cur_v = gen_i2
             continue
         if gen_tag == 'equal':
-            log.d('not equal mod op, equal gen tag')
             yield mod_text[mod_j1:mod_j2]
             cur_v = mod_i2
             continue
-
-        log.d(
-            'yield mod text (cur_v: ' + str(cur_v)
-            + ', mod_j2: ' + str(mod_j2) + '): '
-            + str(mod_text[cur_v:mod_j2]))
         yield mod_text[cur_v:mod_j2]
-        log.d('back from yield mod text')
         if gen_text[cur_v:low_i2] != mod_text[cur_v:low_i2]:
             status = 2
-            log.d('Overwrite merge at line {}'.format(cur_v))
-            log.v('- ' + '- '.join(gen_text[cur_v:low_i2])
-                  + '+ ' + '+ '.join(mod_text[cur_v:low_i2]))
+            log.d('Overwrite merge at line %s', cur_v)
+            if conflicts is not None:
+                conflicts.append(Conflict(
+                    filename, (cur_v, low_i2), gen_text[gen_j1:gen_j2],
+                    mod_text[mod_j1:mod_j2]))
         cur_v = low_i2
-    while van_mod_ops:
-        log.d('popping mod ops')
-        _, _, _, mod_j1, mod_j2 = van_mod_ops.pop(0)
+    for _, _, _, mod_j1, mod_j2 in van_mod_ops[mod_n:]:
         yield mod_text[mod_j1:mod_j2]
-    while van_gen_ops:
-        log.d('popping gen ops')
-        _, _, _, gen_j1, gen_j2 = van_gen_ops.pop(0)
+    for _, _, _, gen_j1, gen_j2 in van_gen_ops[gen_n:]:
         yield gen_text[gen_j1:gen_j2]
-    log.d('yield status')
     yield [status]
 
 
 def clear_temp():
-    """Resets the folder in which raws are mixed."""
-    if not baselines.find_vanilla_raws(False):
+    """Resets the folder in which raws are mixed.
+
+    The folder is built from hard links to the baseline files where the file
+    system allows it; files are only copied when they are about to be written
+    (see `_before_write`). If the folder was built earlier in this session,
+    only the files changed since then are reset.
+    """
+    # pylint:disable=global-statement
+    global _workspace
+    vanilla = baselines.find_vanilla(False)
+    if not vanilla:
         log.e('Could not clear temp: baseline raws unavailable')
         return
-    if os.path.exists(paths.get('baselines', 'temp')):
-        shutil.rmtree(paths.get('baselines', 'temp'))
-    shutil.copytree(baselines.find_vanilla_raws(),
-                    paths.get('baselines', 'temp', 'raw'))
-    shutil.rmtree(paths.get('baselines', 'temp', 'raw', 'graphics'))
-    shutil.copytree(os.path.join(baselines.find_vanilla(), 'data', 'speech'),
-                    paths.get('baselines', 'temp', 'data', 'speech'))
-    with open(paths.get('baselines', 'temp', 'raw', 'installed_raws.txt'),
-              'w', encoding="utf-8") as f:
+    temp = paths.get('baselines', 'temp')
+    if (_workspace is not None and _workspace['vanilla'] == vanilla
+            and os.path.isdir(temp)):
+        _reset_workspace()
+    else:
+        _workspace = None
+        if os.path.exists(temp):
+            shutil.rmtree(temp)
+        _link_tree(os.path.join(vanilla, 'raw'), os.path.join(temp, 'raw'),
+                   skip=('graphics',))
+        _link_tree(os.path.join(vanilla, 'data', 'speech'),
+                   os.path.join(temp, 'data', 'speech'))
+        _workspace = {'vanilla': vanilla, 'root': os.path.abspath(temp),
+                      'dirty': set(), 'dirs': []}
+    merge_log = os.path.join(temp, 'raw', 'installed_raws.txt')
+    _before_write(merge_log)
+    with open(merge_log, 'w', encoding="utf-8") as f:
         f.write('# List of raws merged by PyLNP:\nbaselines/'
-                + os.path.basename(baselines.find_vanilla()) + '\n')
+                + os.path.basename(vanilla) + '\n')
+
+
+def _link_tree(src, dst, skip=()):
+    """Recreates the directory tree <src> at <dst> using hard links, falling
+    back to copies where links are not possible. Top-level directories named
+    in <skip> are left out."""
+    for root, dirs, files in os.walk(src):
+        if root == src:
+            dirs[:] = [d for d in dirs if d not in skip]
+        target = os.path.join(dst, os.path.relpath(root, src))
+        os.makedirs(target, exist_ok=True)
+        for f in files:
+            _link_file(os.path.join(root, f), os.path.join(target, f))
+
+
+def _link_file(src, dst):
+    """Hard links <src> to <dst>, or copies it if linking is not possible."""
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copy2(src, dst)
+
+
+def _reset_workspace():
+    """Restores the files and removes the directories changed in the merge
+    folder since it was built."""
+    temp = paths.get('baselines', 'temp')
+    for path in _workspace['dirty']:
+        if os.path.isfile(path):
+            os.remove(path)
+        rel = os.path.relpath(path, temp).split(os.sep)
+        if rel[0] == 'raw' and rel[1:2] != ['graphics'] or rel[:2] == [
+                'data', 'speech']:
+            van_f = os.path.join(_workspace['vanilla'], *rel)
+            if os.path.isfile(van_f):
+                _link_file(van_f, path)
+    for path in reversed(_workspace['dirs']):
+        try:
+            os.rmdir(path)
+        except OSError:
+            pass
+    log.d('Reset {} files in merge folder'.format(len(_workspace['dirty'])))
+    _workspace['dirty'].clear()
+    _workspace['dirs'] = []
 
 
 def update_raw_dir(path, gfx=('', '')):
@@ -414,16 +689,132 @@ def update_raw_dir(path, gfx=('', '')):
             Tuple of graphics pack to update to,
             and pack installed in baselines/temp/
     """
-    mods_list = read_installation_log(os.path.join(path, 'installed_raws.txt'))
-    built_log = paths.get('baselines', 'temp', 'raw', 'installed_raws.txt')
-    built_mods = read_installation_log(built_log)
-    if mods_list != built_mods or gfx[0] != gfx[1]:
-        if -1 in merge_all_mods(mods_list, gfx[0]):
-            log.w('Some mods in {} could not be re-merged'.format(path))
-            return False
-    shutil.rmtree(path)
-    shutil.copytree(paths.get('baselines', 'temp', 'raw'), path)
-    return True
+    return bool(update_raw_dirs([path], gfx))
+
+
+def update_raw_dirs(raw_dirs, gfx=('', ''), progress=None):
+    """Updates several raw dirs built from the same mods, merging them once.
+    Dirs which already match their manifest are left alone; the others are
+    synced from the merged raws in parallel.
+
+    Arguments:
+        raw_dirs
+            full paths to the dirs to update; the mods are read from the
+            installed_raws.txt of the first one
+        gfx
+            as for `update_raw_dir`
+        progress
+            if given, called as ``progress(path, ok)`` as each dir is done,
+            possibly from another thread
+
+    Returns:
+        list of the dirs which are now up to date.
+    """
+    mods_list = read_installation_log(
+        os.path.join(raw_dirs[0], 'installed_raws.txt'))
+    expected = component_hashes(mods_list, gfx[0])
+    if expected is None:
+        log.e('Cannot update raws: baseline raws unavailable')
+        return []
+    temp_raw = paths.get('baselines', 'temp', 'raw')
+
+    def up_to_date(path):
+        """Returns True if <path> already has the expected raws."""
+        return read_manifest(path).get('components') == expected \
+            and verify_raws(path) == []
+
+    def sync(path):
+        """Copies the merged raws to <path>, returning True if successful."""
+        ok = True
+        try:
+            filesync.sync_tree(temp_raw, path)
+        except Exception:
+            log.e('Could not update ' + path, stack=True)
+            ok = False
+        if progress:
+            progress(path, ok)
+        return ok
+
+    with ThreadPoolExecutor() as pool:
+        current = list(pool.map(up_to_date, raw_dirs))
+        done = [p for p, ok in zip(raw_dirs, current) if ok]
+        stale = [p for p, ok in zip(raw_dirs, current) if not ok]
+        for path in done:
+            log.i(path + ' is already up to date')
+            if progress:
+                progress(path, True)
+        if stale and read_manifest(temp_raw).get('components') != expected \
+                and -1 in merge_all_mods(mods_list, gfx[0]):
+            log.w('Some mods in {} could not be re-merged'.format(
+                ', '.join(stale)))
+            for path in stale:
+                if progress:
+                    progress(path, False)
+            return done
+        return done + [p for p, ok in zip(stale, pool.map(sync, stale)) if ok]
+
+
+def component_hashes(list_of_mods, gfx=None):
+    """Returns [name, hash] pairs for the baseline, graphics pack and mods
+    that a merge of <list_of_mods> would be built from, named as in
+    installed_raws.txt. The baseline is identified by name alone.
+
+    Returns None if no baseline is available."""
+    from . import graphics
+    vanilla = baselines.find_vanilla(False)
+    if not vanilla:
+        return None
+    result = [['baselines/' + os.path.basename(vanilla), '']]
+    if gfx:
+        result.append(['graphics/' + graphics.get_folder_prefix(gfx),
+                       filesync.tree_hash(paths.get('graphics', gfx, 'raw'))])
+    for mod in list_of_mods:
+        result.append(['mods/' + mod,
+                       filesync.tree_hash(paths.get('mods', mod))])
+    return result
+
+
+def write_manifest(raw_dir, gfx=None):
+    """Writes installed_raws.json to <raw_dir>, with the hashes of the merged
+    components listed in installed_raws.txt and of every file in the folder.
+    Nothing is written if no baseline is available.
+    """
+    manifest_file = os.path.join(raw_dir, MANIFEST)
+    mods_list = read_installation_log(
+        os.path.join(raw_dir, 'installed_raws.txt'))
+    components = component_hashes(mods_list, gfx)
+    if components is None:
+        return
+    data = {'components': components,
+            'files': filesync.hash_tree(raw_dir, exclude=(MANIFEST,))}
+    _before_write(manifest_file)
+    with open(manifest_file, 'w', encoding='utf-8') as f:
+        json.dump(data, f, indent=1, sort_keys=True)
+
+
+def read_manifest(raw_dir):
+    """Returns the contents of installed_raws.json in <raw_dir>, or an empty
+    dict if there is none."""
+    try:
+        with open(os.path.join(raw_dir, MANIFEST), encoding='utf-8') as f:
+            return json.load(f)
+    except (IOError, ValueError):
+        return {}
+
+
+def verify_raws(raw_dir):
+    """Checks the files in <raw_dir> against its installed_raws.json.
+
+    Returns:
+        a sorted list of files which are changed, missing or unexpected, or
+        None if there is no manifest to check against.
+    """
+    expected = read_manifest(raw_dir).get('files')
+    if expected is None:
+        return None
+    actual = filesync.hash_tree(raw_dir, exclude=(MANIFEST,))
+    return sorted(f for f in set(expected).union(actual)
+                  if expected.get(f) != actual.get(f))
 
 
 def add_graphics(gfx):
@@ -431,14 +822,17 @@ def add_graphics(gfx):
     from . import graphics
     gfx_raws = paths.get('graphics', gfx, 'raw')
     for root, _, files in os.walk(gfx_raws):
-        dst = paths.get('baselines', 'temp', 'raw',
-                        os.path.relpath(root, gfx_raws))
+        dst = paths.resolve(paths.get('baselines', 'temp', 'raw'),
+                            os.path.relpath(root, gfx_raws))
         if not os.path.isdir(dst):
-            os.makedirs(dst)
+            _makedirs(dst)
         for f in files:
-            shutil.copy2(os.path.join(root, f), dst)
-    with open(paths.get('baselines', 'temp', 'raw', 'installed_raws.txt'),
-              'a', encoding="utf-8") as f:
+            target = paths.resolve(dst, f)
+            _before_write(target)
+            shutil.copy2(os.path.join(root, f), target)
+    merge_log = paths.get('baselines', 'temp', 'raw', 'installed_raws.txt')
+    _before_write(merge_log, overwrite=False)
+    with open(merge_log, 'a', encoding="utf-8") as f:
         f.write('graphics/{}\n'.format(graphics.get_folder_prefix(gfx)))
     log.i('{} graphics added (small mod compatibility risk)'.format(gfx))
 
@@ -458,36 +852,72 @@ def make_mod_from_installed_raws(name):
     as a mod called $name.
 
         * If ``installed_raws.txt`` is not present, compare to vanilla
-        * Otherwise, rebuild as much as possible, then compare to installed
+        * Otherwise, rebuild as much as possible (including the logged
+          graphics pack), then compare to installed
+
+    Installed files which differ, and which a mod would keep, are copied to
+    the new mod as they are; nothing else is written.
+
+    Returns:
+        ``None`` if there are no differences (or no baseline), ``False`` if
+        a mod called $name already exists, otherwise ``True``. If $name is
+        empty, only checks whether there are differences.
     """
-    if get_installed_mods_from_log():
+    vanilla = baselines.find_vanilla()
+    if not vanilla:
+        return None
+    from . import graphics
+    installed = get_installed_mods_from_log()
+    gfx = graphics.logged_pack(paths.get('df', 'raw', 'installed_raws.txt'))
+    reconstruction = vanilla
+    if installed or gfx:
         clear_temp()
-        for mod in get_installed_mods_from_log():
-            merge_a_mod(mod)
-        reconstruction = paths.get('baselines', 'temp2')
-        shutil.copytree(paths.get('baselines', 'temp'), reconstruction)
-    else:
-        reconstruction = baselines.find_vanilla()
-        if not reconstruction:
-            return None
-    clear_temp()
-    merge_folder(os.path.join(reconstruction, 'raw'),
-                 paths.get('df', 'raw'),
-                 paths.get('baselines', 'temp', 'raw'))
-    merge_folder(os.path.join(reconstruction, 'data', 'speech'),
-                 paths.get('df', 'data', 'speech'),
-                 paths.get('baselines', 'temp', 'data', 'speech'))
-    baselines.simplify_pack('temp', 'baselines')
-    baselines.remove_vanilla_raws_from_pack('temp', 'baselines')
-    baselines.remove_empty_dirs('temp', 'baselines')
-    if os.path.isdir(paths.get('baselines', 'temp2')):
-        shutil.rmtree(paths.get('baselines', 'temp2'))
-    if name and os.path.isdir(paths.get('baselines', 'temp')):
-        if os.path.isdir(paths.get('mods', name)):
-            return False
-        shutil.copytree(paths.get('baselines', 'temp'), paths.get('mods', name))
+        if gfx:
+            add_graphics(gfx)
+        for mod in installed:
+            merge_a_mod(mod, vanilla)
+        reconstruction = paths.get('baselines', 'temp')
+    changed = []
+    for folder in (('raw',), ('data', 'speech')):
+        changed += _changed_files(paths.get('df', *folder), [os.path.join(
+            r, *folder) for r in (reconstruction, vanilla)], folder)
+    if not changed:
+        return None
+    if not name:
         return True
-    return None
+    if os.path.isdir(paths.get('mods', name)):
+        return False
+    for src, rel in changed:
+        dst = paths.get('mods', name, rel)
+        os.makedirs(os.path.dirname(dst), exist_ok=True)
+        shutil.copy2(src, dst)
+    log.i('Extracted {} changed files to mod {}'.format(len(changed), name))
+    return True
+
+
+def _changed_files(folder, reconstruction, prefix):
+    """Returns (path, relative path) for mergeable files in <folder> which
+    differ from the first of the <reconstruction> folders to have them (the
+    merge folder leaves out vanilla raw/graphics, so the baseline is checked
+    too). Paths are relative to the mod folder, starting with <prefix>."""
+    result = []
+    for rel, f in filesync.list_files(folder).items():
+        rel = os.path.join(*prefix, *rel.split('/'))
+        if rel.endswith(footprints.TEXT_TYPES + footprints.BINARY_TYPES) \
+                and os.path.basename(rel) != 'installed_raws.txt' \
+                and baselines.is_kept(rel, 'mods'):
+            other = [o for o in (paths.resolve(r, os.path.relpath(f, folder))
+                                 for r in reconstruction) if os.path.isfile(o)]
+            if not other or not filesync.same_file(
+                    f, other[0], os.stat(f), os.stat(other[0])):
+                result.append((f, rel))
+    return result
+
+
+def read_lines(path):
+    """Reads the lines of a raw file for merging, or for footprints."""
+    with open(path, encoding='cp437', errors='replace') as f:
+        return f.readlines()
 
 
 def get_installed_mods_from_log():
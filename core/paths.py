@@ -7,6 +7,9 @@ import os
 from . import log
 
 __paths = {}
+# Directory listings for case-insensitive lookups, as
+# {directory: (mtime, {names}, {lowercase name: name})}
+_listings = {}
 
 
 def _identify_folder_name(base, name):
@@ -19,11 +22,69 @@ def _identify_folder_name(base, name):
         base: the path containing the desired folder.
         name: the standard case name of the desired folder.
     """
-    normal = os.path.join(base, name)
-    lower = os.path.join(base, name.lower())
-    if os.path.isdir(lower) and not os.path.isdir(normal):
-        return lower
-    return normal
+    return os.path.join(base, _lookup(base, name) or name)
+
+
+def resolve(base, rel):
+    """Finds the file or folder <rel> inside <base>, ignoring the case of each
+    path element where the exact name does not exist. Elements which are not
+    found keep the given case, so the result can also be used to create
+    files.
+
+    Each directory is listed once and cached; the listing is refreshed when
+    a name is not found and the directory has changed since.
+
+    Args:
+        base: the folder to start in; not case-corrected.
+        rel: the relative path to find.
+    """
+    path = base
+    parts = [p for p in rel.replace(os.sep, '/').split('/') if p not in ('', '.')]
+    for i, part in enumerate(parts):
+        real = _lookup(path, part)
+        if real is None:
+            return os.path.join(path, *parts[i:])
+        path = os.path.join(path, real)
+    return path
+
+
+def _lookup(directory, name):
+    """Returns the real name of the entry in <directory> matching <name>,
+    preferring an exact match, or None if there is none."""
+    listing = _listings.get(directory)
+    if listing is None:
+        listing = _scan(directory)
+    if name in listing[1]:
+        return name
+    real = listing[2].get(name.lower())
+    if real is None and listing[0] != mtime(directory):
+        listing = _scan(directory)
+        real = name if name in listing[1] else listing[2].get(name.lower())
+    return real
+
+
+def _scan(directory):
+    """Lists <directory> into the lookup cache and returns the listing."""
+    stamp = mtime(directory)
+    exact, lower = set(), {}
+    try:
+        with os.scandir(directory) as it:
+            for entry in it:
+                exact.add(entry.name)
+                lower.setdefault(entry.name.lower(), entry.name)
+    except OSError:
+        pass
+    _listings[directory] = (stamp, exact, lower)
+    return _listings[directory]
+
+
+def mtime(*parts):
+    """Returns the modification time of the path made by joining <parts>, or
+    None if it is missing."""
+    try:
+        return os.stat(os.path.join(*parts)).st_mtime_ns
+    except OSError:
+        return None
 
 
 def register(name, *path_elms, **kwargs):
@@ -60,3 +121,4 @@ def get(name, *paths):
 def clear():
     """Clears the path cache."""
     __paths.clear()
+    _listings.clear()
@@ -0,0 +1,98 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Updates mods made for one DF baseline to another."""
+
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from . import baselines, log, mods, paths
+
+
+def rebase_mods(list_of_mods, old, new):
+    """Updates mods made for the baseline <old> to the baseline <new>.
+
+    Only raws which differ between the baselines (found by comparing their
+    store manifests) are merged: the mod's changes are applied on top of the
+    new vanilla file with the usual three-way merge, and the mod's copy is
+    replaced. Mods are rebased in parallel; a mod's files are only replaced
+    once all of them have been merged.
+
+    Params:
+        list_of_mods
+            Names of mods in LNP/Mods.
+        old, new
+            Baseline versions, eg ``'df_47_04'`` and ``'df_47_05'``.
+
+    Returns:
+        dict of {mod: {'status': int, 'conflicts': int, 'files': {path:
+        status}}}, using the statuses of `mods.merge_file`, or None if either
+        baseline is missing. Files which the mod changed, but were added or
+        removed in <new>, or are not text, get status 1.
+    """
+    versions = baselines.get_versions()
+    if old not in versions or new not in versions:
+        log.e('Cannot rebase mods: baselines {} and {} are needed'.format(
+            old, new))
+        return None
+    delta = baselines.diff_versions(old, new)
+    raws = [f for f in delta['changed'] if f.lower().startswith(
+        ('raw/', 'data/speech/'))]
+    texts = {f: tuple(mods.read_lines(os.path.join(versions[v], *f.split('/')))
+                      for v in (old, new))
+             for f in raws if f.endswith(('.txt', '.init'))}
+    review = [f for f in delta['added'] + delta['removed'] + raws
+              if f not in texts]
+    with ThreadPoolExecutor() as pool:
+        results = dict(zip(list_of_mods, pool.map(
+            lambda m: _rebase_mod(m, texts, review), list_of_mods)))
+    log.i('Rebased {} mods from {} to {} ({} changed raws): {}'.format(
+        len(results), old, new, len(raws), ', '.join(
+            '{} {}'.format(m, r['status']) for m, r in results.items())))
+    return results
+
+
+def _rebase_mod(mod, texts, review):
+    """Rebases one mod; see `rebase_mods`.
+
+    Params:
+        texts
+            dict of {path: (old lines, new lines)} for changed text files.
+        review
+            Paths which are reported with status 1 if the mod has them.
+    """
+    folder = paths.get('mods', mod)
+    report = {'status': 0, 'conflicts': 0, 'files': {}}
+    try:
+        merged = {}
+        for rel, (van_lines, new_lines) in texts.items():
+            mod_f = paths.resolve(folder, rel)
+            if not os.path.isfile(mod_f):
+                continue
+            mod_lines = mods.read_lines(mod_f)
+            if not mod_lines:
+                # Blank files deliberately remove vanilla raws
+                continue
+            conflicts = []
+            status, lines = mods.merge_line_list(
+                mod_lines, list(van_lines), list(new_lines), conflicts, rel)
+            report['files'][rel] = status
+            report['conflicts'] += len(conflicts)
+            if lines != mod_lines:
+                merged[mod_f] = lines
+        for rel in review:
+            if os.path.isfile(paths.resolve(folder, rel)):
+                report['files'][rel] = 1
+        for mod_f, lines in merged.items():
+            with open(mod_f + '.rebase', 'w', encoding='cp437') as f:
+                f.writelines(lines)
+        for mod_f in merged:
+            os.replace(mod_f + '.rebase', mod_f)
+    except Exception:
+        log.e('Could not rebase mod ' + mod, stack=True)
+        for mod_f in merged:
+            if os.path.isfile(mod_f + '.rebase'):
+                os.remove(mod_f + '.rebase')
+        report.update(files={}, status=3)
+        return report
+    report['status'] = max(report['files'].values(), default=0)
+    return report
@@ -0,0 +1,137 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Downscaled previews of tilesets and graphics pack art.
+
+Thumbnails are made in a small pool of worker threads and kept as PNG files
+in an on-disk cache, named after the hash of the source image. The cache is
+trimmed to its size limit by removing the least recently used files.
+
+Making thumbnails needs a PIL-compatible library (eg Pillow); without one,
+only PNG images which are already small enough are offered as previews.
+"""
+
+import os
+import queue
+from threading import Lock, Thread, get_ident
+
+from . import filesync, imageinfo, log, paths
+
+try:  # PIL-compatible library (e.g. Pillow); optional
+    # pylint:disable=import-error
+    from PIL import Image
+except ImportError:
+    Image = None
+
+SIZE = (128, 128)
+# Size limit for the thumbnail cache, in bytes
+CACHE_LIMIT = 16 * 1024 * 1024
+WORKERS = 2
+
+# Daemon worker threads, so queued work never holds up closing the program
+_workers = []
+_queue = queue.Queue()
+_lock = Lock()
+# Sources being processed, as {(path, size): [callback, ...]}
+_pending = {}
+# Total size of the cache folder, once known
+_cache_size = None
+
+
+def cache_folder():
+    """Returns the folder thumbnails are cached in."""
+    return paths.get('baselines', 'cache', 'thumbnails')
+
+
+def request(path, callback, size=SIZE):
+    """Asks for a thumbnail of the image at <path>.
+
+    ``callback(path, thumbnail)`` is called from a worker thread once the
+    thumbnail is ready, where <thumbnail> is the path of a PNG file no
+    larger than <size>, or None if no preview can be made. Requests for an
+    image which is already being processed share the result.
+    """
+    key = (path, tuple(size))
+    with _lock:
+        if key in _pending:
+            _pending[key].append(callback)
+            return
+        _pending[key] = [callback]
+        if not _workers:
+            for _ in range(WORKERS):
+                _workers.append(Thread(target=_work, daemon=True))
+                _workers[-1].start()
+    _queue.put(key)
+
+
+def _work():
+    """Makes thumbnails for queued requests, passing them to the waiting
+    callbacks."""
+    while True:
+        key = _queue.get()
+        try:
+            result = get_thumbnail(*key)
+        except Exception:
+            log.w('Could not make a thumbnail of ' + key[0], stack=True)
+            result = None
+        with _lock:
+            callbacks = _pending.pop(key, [])
+        for callback in callbacks:
+            callback(key[0], result)
+
+
+def get_thumbnail(path, size=SIZE):
+    """Returns the path of a cached thumbnail of the image at <path>, making
+    it if needed, or None if no preview can be made. This reads and may
+    decode the image; use `request` from UI code."""
+    info = imageinfo.read_info(path)
+    if info is None:
+        return None
+    if info.format == 'png' and info.width <= size[0] \
+            and info.height <= size[1]:
+        return path
+    if Image is None:
+        return None
+    target = os.path.join(cache_folder(), '{}-{}x{}.png'.format(
+        filesync.hash_file(path), *size))
+    try:
+        os.utime(target)
+        return target
+    except OSError:
+        pass
+    image = Image.open(path)
+    image.thumbnail(size, getattr(Image, 'Resampling', Image).LANCZOS)
+    if image.mode not in ('RGB', 'RGBA'):
+        image = image.convert('RGBA')
+    os.makedirs(cache_folder(), exist_ok=True)
+    # Identical images at different paths may be processed at the same time
+    temp = '{}.{}.tmp'.format(target, get_ident())
+    image.save(temp, 'PNG')
+    os.replace(temp, target)
+    _add_to_cache(os.path.getsize(target))
+    return target
+
+
+def _add_to_cache(nbytes):
+    """Records a new cache file, and removes the least recently used ones if
+    the cache has grown past its limit."""
+    # pylint:disable=global-statement
+    global _cache_size
+    with _lock:
+        if _cache_size is None:
+            _cache_size = sum(e.stat().st_size for e in os.scandir(
+                cache_folder()) if e.is_file())
+        else:
+            _cache_size += nbytes
+        if _cache_size <= CACHE_LIMIT:
+            return
+        entries = sorted((e for e in os.scandir(cache_folder())
+                          if e.is_file()), key=lambda e: e.stat().st_mtime)
+        # Trim to 3/4 of the limit, so trimming does not happen every time
+        for e in entries:
+            if _cache_size <= CACHE_LIMIT * 3 // 4:
+                break
+            try:
+                _cache_size -= e.stat().st_size
+                os.remove(e.path)
+            except OSError:
+                pass
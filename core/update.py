@@ -98,7 +98,14 @@ def download_df_baseline(immediate=False):
     url = 'https://www.bay12games.com/dwarves/' + filename
     target = os.path.join(paths.get('baselines'), filename)
     queue_name = 'immediate' if immediate else 'baselines'
-    download.download(queue_name, url, target)
+    download.download(queue_name, url, target,
+                      end_callback=_baseline_downloaded)
+
+
+def _baseline_downloaded(*_):
+    """Makes the baselines folder be scanned again after a download."""
+    from . import baselines
+    baselines.invalidate()
 
 
 def direct_download_pack():
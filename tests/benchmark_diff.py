@@ -0,0 +1,65 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Times the diff backends on raw-like input.
+
+Run from the repository root with ``python -m tests.benchmark_diff``, or pass
+two files to diff those instead.
+"""
+
+import random
+import sys
+import timeit
+
+from core import diff
+
+
+def creature_raw(rng, lines):
+    """Returns about <lines> lines resembling a creature raw file."""
+    tags = ['\t[BIOME:ANY_LAND]', '\t[LARGE_ROAMING]', '\t[PET]', '\t[NOFEAR]',
+            '\t[BODY:QUADRUPED_NECK:TAIL:2EYES:2EARS:NOSE:2LUNGS]',
+            '\t[BODY_SIZE:0:0:5000]', '\t[ATTACK:BITE:BODYPART:BY_CATEGORY:'
+            'MOUTH]', '\t\t[ATTACK_SKILL:BITE]', '']
+    result = []
+    while len(result) < lines:
+        result.append('[CREATURE:C{}]'.format(len(result)))
+        result.extend(rng.choice(tags) for _ in range(rng.randint(10, 40)))
+    return result
+
+
+def cases():
+    """Yields (description, a, b) pairs to time."""
+    rng = random.Random(0)
+    a = creature_raw(rng, 10400)
+    b = a[:4000] + creature_raw(rng, 3000) + a[7000:]
+    yield 'creature raw, 3k lines replaced', a, b
+    b = list(a)
+    for _ in range(50):
+        pos = rng.randrange(len(b))
+        b[pos:pos + 3] = ['\t[NEW_TAG:{}]'.format(pos)]
+    yield 'creature raw, 50 small edits', a, b
+    yield 'swapped repetitive blocks', ['x'] * 3000 + ['y'] * 3000, \
+        ['y'] * 3000 + ['x'] * 3000
+
+
+def main(args):
+    """Prints the time each backend takes for each case."""
+    if len(args) == 2:
+        with open(args[0], encoding='cp437') as f:
+            a = f.readlines()
+        with open(args[1], encoding='cp437') as f:
+            b = f.readlines()
+        todo = [(' vs '.join(args), a, b)]
+    else:
+        todo = cases()
+    for name, a, b in todo:
+        print('{} ({} vs {} lines)'.format(name, len(a), len(b)))
+        for backend in sorted(diff.BACKENDS):
+            runs = 3
+            seconds = timeit.timeit(
+                lambda a=a, b=b, name=backend: diff.get_opcodes(a, b, name),
+                number=runs)
+            print('  {:10} {:8.1f} ms'.format(backend, seconds / runs * 1000))
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,211 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Checks the diff backends against difflib on random and worst-case input,
+and that merges give the same result with either backend."""
+
+import random
+import unittest
+
+from core import diff, mods
+
+
+def apply_opcodes(a, b, opcodes):
+    """Rebuilds <b> from <a> and the opcodes, checking they are well formed."""
+    result, i, j = [], 0, 0
+    for tag, i1, i2, j1, j2 in opcodes:
+        assert (i1, j1) == (i, j), 'opcodes must be contiguous'
+        assert tag in ('equal', 'replace', 'delete', 'insert')
+        if tag == 'equal':
+            assert a[i1:i2] == b[j1:j2]
+        elif tag == 'delete':
+            assert i1 < i2 and j1 == j2
+        elif tag == 'insert':
+            assert i1 == i2 and j1 < j2
+        else:
+            assert i1 < i2 and j1 < j2
+        if tag != 'delete':
+            result.extend(b[j1:j2])
+        i, j = i2, j2
+    assert (i, j) == (len(a), len(b)), 'opcodes must cover both sequences'
+    return result
+
+
+def matched(opcodes):
+    """Returns the number of lines the opcodes leave unchanged."""
+    return sum(i2 - i1 for tag, i1, i2, _, _ in opcodes if tag == 'equal')
+
+
+def lcs_length(a, b):
+    """Returns the length of the longest common subsequence of a and b."""
+    row = [0] * (len(b) + 1)
+    for x in a:
+        prev = 0
+        for j, y in enumerate(b):
+            prev, row[j + 1] = row[j + 1], (
+                prev + 1 if x == y else max(row[j + 1], row[j]))
+    return row[-1]
+
+
+def mutate(rng, lines, alphabet):
+    """Returns a copy of <lines> with random insertions, deletions and
+    replacements."""
+    result = list(lines)
+    for _ in range(rng.randint(0, 8)):
+        pos = rng.randint(0, len(result))
+        op = rng.choice(('insert', 'delete', 'replace'))
+        count = rng.randint(1, 4)
+        if op == 'insert':
+            result[pos:pos] = [rng.choice(alphabet) for _ in range(count)]
+        elif op == 'delete':
+            del result[pos:pos + count]
+        else:
+            result[pos:pos + count] = [
+                rng.choice(alphabet) for _ in range(count)]
+    return result
+
+
+def creature_objects(rng, count):
+    """Returns <count> lists of lines resembling creatures in an object raw."""
+    tags = ['\t[BIOME:ANY_LAND]\n', '\t[LARGE_ROAMING]\n', '\t[PET]\n',
+            '\t[NOFEAR]\n', '\t[BODY_SIZE:0:0:5000]\n', '\n',
+            '\t[ATTACK:BITE:BODYPART:BY_CATEGORY:MOUTH]\n']
+    return [['[CREATURE:C{}]\n'.format(n)] + [
+        rng.choice(tags) for _ in range(rng.randint(5, 25))]
+            for n in range(count)]
+
+
+def edit_object(rng, lines):
+    """Returns a copy of a creature with a few tags changed, added or
+    removed; the first line is left alone."""
+    result = list(lines)
+    for _ in range(rng.randint(1, 3)):
+        pos = rng.randint(1, len(result))
+        op = rng.random()
+        if op < 0.4 and pos < len(result):
+            result[pos] = '\t[EDIT:{}]\n'.format(rng.randrange(99))
+        elif op < 0.7:
+            result.insert(pos, '\t[NEW:{}]\n'.format(rng.randrange(99)))
+        elif pos < len(result):
+            del result[pos]
+    return result
+
+
+class DiffBackendTest(unittest.TestCase):
+    """Tests for core.diff."""
+
+    def check(self, a, b):
+        """Checks every backend produces valid opcodes for a and b."""
+        for name in diff.BACKENDS:
+            with self.subTest(backend=name, a=a, b=b):
+                self.assertEqual(
+                    apply_opcodes(a, b, diff.get_opcodes(a, b, name)), b)
+
+    def test_edge_cases(self):
+        """Empty, identical and disjoint sequences."""
+        for a, b in [([], []), ([], ['x']), (['x'], []), (['x'], ['x']),
+                     (['x'], ['y']), (list('abc'), list('abc')),
+                     (list('abc'), list('xyz'))]:
+            self.check(a, b)
+
+    def test_fuzz(self):
+        """Random edits of sequences with few distinct lines, where most
+        regions have no unique anchors and Myers does the work."""
+        rng = random.Random(26)
+        for _ in range(2000):
+            alphabet = [str(n) for n in range(rng.randint(1, 6))]
+            a = [rng.choice(alphabet) for _ in range(rng.randint(0, 40))]
+            b = mutate(rng, a, alphabet) if rng.random() < 0.7 else [
+                rng.choice(alphabet) for _ in range(rng.randint(0, 40))]
+            self.check(a, b)
+
+    def test_myers_is_minimal(self):
+        """Below the cost cap, Myers finds a longest common subsequence."""
+        # pylint:disable=protected-access
+        rng = random.Random(27)
+        for _ in range(500):
+            a = [rng.choice('abc') for _ in range(rng.randint(1, 30))]
+            b = [rng.choice('abc') for _ in range(rng.randint(1, 30))]
+            blocks = diff._myers(a, 0, len(a), b, 0, len(b))
+            ops = diff._opcodes_from_blocks(blocks, len(a), len(b))
+            self.assertEqual(apply_opcodes(a, b, ops), b)
+            self.assertEqual(matched(ops), lcs_length(a, b))
+
+    def test_raw_like(self):
+        """Edits to a raw-like file keep all untouched lines equal."""
+        rng = random.Random(28)
+        a = []
+        for n in range(300):
+            a.append('[CREATURE:C{}]'.format(n))
+            a.extend(rng.choice(['\t[BIOME:ANY_LAND]', '\t[LARGE_ROAMING]',
+                                 '\t[PET]', '\t[NOFEAR]', '']) for _ in range(5))
+        b = mutate(rng, a, ['\t[PET]', '\t[NEW_TAG]', ''])
+        for name in diff.BACKENDS:
+            ops = diff.get_opcodes(a, b, name)
+            self.assertEqual(apply_opcodes(a, b, ops), b)
+        self.assertGreaterEqual(matched(diff.get_opcodes(a, b, 'patience')),
+                                matched(diff.get_opcodes(a, b, 'difflib')))
+
+    def test_worst_cases(self):
+        """Large, distant regions without unique lines fall back to difflib
+        instead of taking quadratic time."""
+        a = ['x'] * 3000 + ['y'] * 3000
+        b = ['y'] * 3000 + ['x'] * 3000
+        self.check(a, b)
+        rng = random.Random(29)
+        a = [rng.choice('ab') for _ in range(10000)]
+        b = a[:4000] + [rng.choice('ab') for _ in range(3000)] + a[7000:]
+        self.check(a, b)
+
+
+
+class MergeEquivalenceTest(unittest.TestCase):
+    """Merges raw-like files with each backend."""
+
+    def merge(self, mod, van, gen):
+        """Returns the line-by-line merge of <mod> into <gen> with each
+        backend, as {backend: (status, lines)}."""
+        result = {}
+        for name in diff.BACKENDS:
+            old = diff.get_backend()
+            diff.set_backend(name)
+            try:
+                result[name] = mods.merge_line_list(
+                    mod, van, gen, [], 'creature_test.txt', by_object=False)
+            finally:
+                diff.set_backend(old)
+        return result
+
+    def test_separate_objects(self):
+        """Mods changing different creatures merge to the same, correct
+        file with every backend."""
+        rng = random.Random(30)
+        for _ in range(100):
+            objects = creature_objects(rng, rng.randint(20, 60))
+            order = list(range(len(objects)))
+            rng.shuffle(order)
+            gen_ids, mod_ids = set(order[:5]), set(order[5:10])
+            gen = [edit_object(rng, o) if n in gen_ids else o
+                   for n, o in enumerate(objects)]
+            mod = [edit_object(rng, o) if n in mod_ids else o
+                   for n, o in enumerate(objects)]
+            expected = [line for n in range(len(objects)) for line in (
+                gen[n] if n in gen_ids else mod[n])]
+            for name, (status, lines) in self.merge(
+                    sum(mod, []), sum(objects, []), sum(gen, [])).items():
+                with self.subTest(backend=name):
+                    self.assertEqual(status, 0)
+                    self.assertEqual(lines, expected)
+
+    def test_same_status(self):
+        """Mods with arbitrary, possibly overlapping, edits get the same
+        merge status with every backend."""
+        rng = random.Random(31)
+        for _ in range(100):
+            van = sum(creature_objects(rng, 30), [])
+            results = self.merge(mutate(rng, van, ['\t[PET]\n', '\n']), van,
+                                 mutate(rng, van, ['\t[NOFEAR]\n', '\n']))
+            self.assertEqual(len({s for s, _ in results.values()}), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -3,11 +3,12 @@
 # pylint:disable=unused-wildcard-import,wildcard-import,attribute-defined-outside-init
 """Graphics tab for the TKinter GUI."""
 
+import queue
 from tkinter import *  # noqa: F403
 from tkinter import messagebox
 from tkinter.ttk import *  # noqa: F403
 
-from core import colors, graphics, paths
+from core import colors, graphics, paths, thumbnails
 from core.lnp import lnp
 
 from . import binding, controls, tkhelpers
@@ -22,6 +23,10 @@ class GraphicsTab(Tab):
         self.graphics = Variable()
         self.colors = Variable()
         self.tilesets = Variable()
+        # Thumbnails by source image, and the image wanted by each preview
+        self.thumbnails = {}
+        self.previews = {}
+        self.ready = queue.Queue()
 
     def read_data(self):
         self.read_graphics()
@@ -50,6 +55,9 @@ class GraphicsTab(Tab):
         self._create_tilesets_group(customize_tab).pack(fill=BOTH, expand=Y)
         self._create_cs_group(customize_tab).pack(fill=BOTH, expand=N)
 
+        self.winfo_toplevel().bind(
+            '<<ThumbnailReady>>', lambda e: self.show_thumbnails(), add='+')
+
     def _create_cg_group(self, parent, show_title=True):
         title = 'Change Graphics' if show_title else None
         change_graphics = controls.create_control_group(parent, title, True)
@@ -62,6 +70,8 @@ class GraphicsTab(Tab):
             listframe, None, self.graphics, height=8)
         self.graphicpacks.bind(
             '<<ListboxSelect>>', lambda e: self.select_graphics())
+        self.pack_preview = Label(change_graphics, anchor=CENTER)
+        grid.add(self.pack_preview, 2)
         controls.listbox_dyn_tooltip(
             self.graphicpacks, lambda i: self.packs[i], graphics.get_tooltip)
         for seq in ("<Double-1>", "<Return>"):
@@ -116,12 +126,19 @@ class GraphicsTab(Tab):
             customize, 'FONT', self.tilesets)
         for seq in ("<Double-1>", "<Return>"):
             self.fonts.bind(seq, lambda e: self.install_tilesets(1))
+        self.fonts.bind('<<ListboxSelect>>', lambda e: self.preview(
+            self.tileset_preview, self.fonts))
 
         if lnp.settings.version_has_option('GRAPHICS_FONT'):
             _, self.graphicsfonts = controls.create_file_list(
                 customize, 'GRAPHICS_FONT', self.tilesets)
             for seq in ("<Double-1>", "<Return>"):
                 self.graphicsfonts.bind(seq, lambda e: self.install_tilesets(2))
+            self.graphicsfonts.bind('<<ListboxSelect>>', lambda e: self.preview(
+                self.tileset_preview, self.graphicsfonts))
+
+        self.tileset_preview = Label(customize, anchor=CENTER)
+        self.tileset_preview.pack(fill=X)
 
         buttons = controls.create_control_group(customize, None, True)
         buttons.pack(fill=X)
@@ -188,7 +205,9 @@ class GraphicsTab(Tab):
 
     def read_graphics(self):
         """Reads list of graphics packs."""
-        packs = self.packs = [p[0] for p in graphics.read_graphics()]
+        found = graphics.read_graphics()
+        packs = self.packs = [p[0] for p in found]
+        self.pack_fonts = {p[0]: p[1] for p in found}
         self.graphics.set(tuple(sorted([graphics.get_title(p) for p in packs])))
         current = graphics.current_pack()
         default_bg = Style().lookup('TListbox', 'fill')
@@ -268,8 +287,8 @@ class GraphicsTab(Tab):
         if not tkhelpers.check_vanilla_raws():
             return
         self.read_graphics()
-        for pack in self.graphics.get():
-            result = graphics.simplify_pack(pack)
+        results = graphics.simplify_packs(self.graphics.get())
+        for pack, result in results.items():
             if result is None:
                 messagebox.showinfo(
                     title='Error occurred', message='No files in: ' + str(pack))
@@ -336,6 +355,9 @@ class GraphicsTab(Tab):
         colorscheme = None
         if len(self.graphicpacks.curselection()) != 0:
             pack = self.packs[int(self.graphicpacks.curselection()[0])]
+            if self.pack_fonts.get(pack):
+                self.show_preview(self.pack_preview, paths.get(
+                    'graphics', pack, 'data', 'art', self.pack_fonts[pack]))
             if lnp.df_info.version >= '0.31.04':
                 colorscheme = paths.get('graphics', pack, 'data', 'init',
                                         'colors.txt')
@@ -344,6 +366,45 @@ class GraphicsTab(Tab):
                                         'init.txt')
         self.paint_color_preview(colorscheme)
 
+    def preview(self, label, listbox):
+        """Shows a preview of the tileset selected in <listbox>."""
+        if listbox.curselection():
+            self.show_preview(label, paths.get(
+                'data', 'art', listbox.get(listbox.curselection()[0])))
+
+    def show_preview(self, label, path):
+        """Shows a thumbnail of the image at <path> in <label>, once it has
+        been made in the background."""
+        self.previews[label] = path
+        if path in self.thumbnails:
+            self.show_thumbnails()
+        else:
+            thumbnails.request(path, self.thumbnail_ready)
+
+    def thumbnail_ready(self, path, thumbnail):
+        """Called from a worker thread when a thumbnail is ready."""
+        self.ready.put((path, thumbnail))
+        if lnp.ui:
+            lnp.ui.queue.put('<<ThumbnailReady>>')
+
+    def show_thumbnails(self):
+        """Records finished thumbnails and updates the previews."""
+        while not self.ready.empty():
+            path, thumbnail = self.ready.get()
+            self.thumbnails[path] = thumbnail
+        for label, path in self.previews.items():
+            thumbnail = self.thumbnails.get(path)
+            if getattr(label, 'source', None) == thumbnail:
+                continue
+            image = None
+            try:
+                if thumbnail:
+                    image = PhotoImage(file=thumbnail)
+            except TclError:
+                pass
+            label.configure(image=image or '')
+            label.image, label.source = image, thumbnail
+
     def select_colors(self):
         """Event handler for selecting a colorscheme."""
         colorscheme = None
@@ -379,9 +440,21 @@ class GraphicsTab(Tab):
         """Reads list of graphics packs."""
         files = graphics.read_tilesets()
         self.tilesets.set(files)
+        # Make thumbnails in the background, so previews show up at once
+        self.thumbnails.clear()
+        for f in files:
+            thumbnails.request(paths.get('data', 'art', f), self.thumbnail_ready)
         current = graphics.current_tilesets()
+        index = graphics.tileset_index()
+        listboxes = [self.fonts]
+        if lnp.settings.version_has_option('GRAPHICS_FONT'):
+            listboxes.append(self.graphicsfonts)
         default_bg = Style().lookup('TListbox', 'fill')
         for i, f in enumerate(files):
+            # Grey out images which are not a 16x16 grid of tiles
+            usable = f in index and index[f].tile_size
+            for listbox in listboxes:
+                listbox.itemconfig(i, fg='' if usable else 'gray')
             if f == current[0]:
                 self.fonts.itemconfig(i, bg='pale green')
             else:
@@ -3,13 +3,15 @@
 # pylint:disable=unused-wildcard-import,wildcard-import,attribute-defined-outside-init
 """Mods tab for the TKinter GUI."""
 
+import os
+from threading import Thread
 from tkinter import *  # noqa: F403
 from tkinter import messagebox, simpledialog
 from tkinter.ttk import *  # noqa: F403
 
-from core import mods
+from core import footprints, mods
 
-from . import controls, tkhelpers
+from . import binding, controls, tkhelpers
 from .layout import GridLayouter
 from .tab import Tab
 
@@ -29,6 +31,9 @@ class ModsTab(Tab):
         self.installed = mods.get_installed_mods_from_log()
         self.available = [m for m in self.available if m not in self.installed]
         self.update_lists()
+        # Warm the footprint cache so overlaps can be shown before merging
+        Thread(target=footprints.get_footprints,
+               args=(self.available + self.installed,), daemon=True).start()
 
     def create_controls(self):
         Grid.columnconfigure(self, 0, weight=1, uniform="mods")
@@ -41,7 +46,8 @@ class ModsTab(Tab):
         install_frame, self.installed_list = controls.create_file_list(
             f, None, self.installed_var, selectmode='multiple')
         controls.listbox_dyn_tooltip(
-            self.installed_list, lambda i: self.installed[i], mods.get_tooltip)
+            self.installed_list, lambda i: self.installed[i],
+            self.get_installed_tooltip)
         self.installed_list.bind(
             "<Double-1>", lambda e: self.remove_from_installed())
         reorder_frame = controls.create_control_group(install_frame, None)
@@ -62,7 +68,8 @@ class ModsTab(Tab):
         _, self.available_list = controls.create_file_list(
             f, None, self.available_var, selectmode='multiple')
         controls.listbox_dyn_tooltip(
-            self.available_list, lambda i: self.available[i], mods.get_tooltip)
+            self.available_list, lambda i: self.available[i],
+            self.get_available_tooltip)
         self.available_list.bind(
             "<Double-1>", lambda e: self.add_to_installed())
         main_grid.add(f, 2)
@@ -75,6 +82,18 @@ class ModsTab(Tab):
             'Whether to start with the current graphics pack, or '
             'vanilla (ASCII) raws', self.toggle_preload, 'premerge_graphics',
             lambda v: ('NO', 'YES')[mods.will_premerge_gfx()]))
+        main_grid.add(controls.create_trigger_option_button(
+            self, 'Merge by Object',
+            'Whether to merge object raws one object at a time (faster, '
+            'fewer false overlaps), or line by line', self.toggle_object_merge,
+            'merge_objects',
+            lambda v: ('NO', 'YES')[mods.will_merge_objects()]))
+        main_grid.add(controls.create_trigger_option_button(
+            self, 'Patience Diff',
+            'Whether to find changes with patience diff, which is faster on '
+            'large raws with small edits, or difflib', self.toggle_patience,
+            'diff_backend',
+            lambda v: ('NO', 'YES')[mods.will_use_patience_diff()]))
         main_grid.add(controls.create_trigger_button(
             self, 'Simplify Mods', 'Removes unnecessary files.',
             self.simplify_mods))
@@ -82,6 +101,10 @@ class ModsTab(Tab):
             self, 'Extract Installed', 'Creates a mod from unique changes '
             'to your installed raws.  Use to preserve custom tweaks.',
             self.create_from_installed))
+        main_grid.add(controls.create_trigger_button(
+            self, 'Suggest Order', 'Reorders merged mods to minimize '
+            'overlapping changes, without trying each order.',
+            self.suggest_order))
 
     def update_lists(self):
         """Updates the lists."""
@@ -89,11 +112,56 @@ class ModsTab(Tab):
         self.available_var.set(tuple(mods.get_title(m) for m in self.available))
         self.installed_var.set(tuple(mods.get_title(m) for m in self.installed))
 
+    @staticmethod
+    def get_installed_tooltip(mod):
+        """Returns the tooltip for a merged mod, listing any overlaps."""
+        tooltip = mods.get_tooltip(mod)
+        overlaps = mods.get_conflicts(mod)
+        if overlaps:
+            if tooltip:
+                tooltip += '\n\n'
+            tooltip += 'Overlapping changes:'
+            for c in overlaps[:10]:
+                tooltip += '\n{} (vanilla lines {}-{})'.format(
+                    os.path.basename(c.file), c.vanilla_range[0] + 1,
+                    c.vanilla_range[1])
+            if len(overlaps) > 10:
+                tooltip += '\n...and {} more'.format(len(overlaps) - 10)
+        return tooltip
+
+    def get_available_tooltip(self, mod):
+        """Returns the tooltip for an available mod, listing any merged mods
+        it overlaps with."""
+        tooltip = mods.get_tooltip(mod)
+        # None until the footprints have been computed in the background
+        overlaps = footprints.conflicts_with(mod, self.installed)
+        if overlaps:
+            if tooltip:
+                tooltip += '\n\n'
+            tooltip += 'Overlaps with merged mods:'
+            for m in overlaps:
+                tooltip += '\n' + mods.get_title(m)
+        return tooltip
+
     @staticmethod
     def toggle_preload():
         """Toggles whether to preload graphics before merging mods."""
         mods.toggle_premerge_gfx()
 
+    def toggle_object_merge(self):
+        """Toggles whether to merge object raws by object, and re-merges."""
+        mods.toggle_object_merge()
+        binding.update()
+        if self.installed:
+            self.perform_merge()
+
+    def toggle_patience(self):
+        """Toggles the diff backend, and re-merges."""
+        mods.toggle_patience_diff()
+        binding.update()
+        if self.installed:
+            self.perform_merge()
+
     def move_up(self):
         """Moves the selected item/s up in the merge order and re-merges."""
         if len(self.installed_list.curselection()) == 0:
@@ -136,6 +204,20 @@ class ModsTab(Tab):
                 self.installed_list.select_set(i - 1 + int(first_missed))
         self.perform_merge()
 
+    def suggest_order(self):
+        """Reorders merged mods to reduce overlaps, then re-merges."""
+        if len(self.installed) < 2 or not tkhelpers.check_vanilla_raws():
+            return
+        order, overlapping, _ = footprints.suggest_order(self.installed)
+        if order == self.installed:
+            messagebox.showinfo(
+                'Suggest Order', 'The current order is already the best '
+                'found ({} mods with overlaps).'.format(overlapping))
+            return
+        self.installed = order
+        self.update_lists()
+        self.perform_merge()
+
     def create_from_installed(self):
         """Extracts a mod from the currently installed raws."""
         if mods.make_mod_from_installed_raws('') is not None: